@@ -16,12 +16,38 @@ Usage:
   sudo python3 exfil0IMSI.py
 """
 
+import array
+import contextlib
 import csv
+import fcntl
+import io
 import subprocess
 import sys
 import re
 import os
+import queue
+import shutil
+import signal
+import tempfile
+import threading
 import time
+import types
+
+# Optional: google-re2 runs the scanner pattern as a DFA (no backtracking)
+try:
+    import re2 as scanner_re
+except ImportError:
+    scanner_re = re
+
+# grgsm_scanner lines look like:
+#   Found: ARFCN:  975, Freq:  925.2M, CID: 38001, LAC: 30412, MCC: 655, MNC:  10, Pwr: -26
+# The pattern is anchored at the "ARFCN:" sentinel, so lines without it never reach the regex.
+# Scanner output is ASCII, so it is matched as raw bytes without decoding.
+SCANNER_NEEDLE = b"ARFCN:"
+SCANNER_LINE_RE = scanner_re.compile(
+    rb"ARFCN:\s+(?P<arfcn>\d+),\s+Freq:\s+(?P<freq>[\d\.]+[MG]),\s+CID:\s+(?P<cid>\d+),"
+    rb"\s+LAC:\s+(?P<lac>\d+),\s+MCC:\s+(?P<mcc>\d+),\s+MNC:\s+(?P<mnc>\d+),\s+Pwr:\s+(?P<pwr>-?\d+)"
+)
 
 # ANSI color codes
 RESET  = "\033[0m"
@@ -29,37 +55,94 @@ BOLD   = "\033[1m"
 GREEN  = "\033[92m"
 RED    = "\033[91m"
 
+# Skip ANSI escapes entirely when output is piped or redirected
+if not sys.stdout.isatty():
+    RESET = BOLD = GREEN = RED = ""
+
+# Static color-wrapped messages, composed once after the TTY check above
+MSG_BANNER             = f"{BOLD}{GREEN}\nEvade the matrix. Sniff IMSI. Let's go...\n\n{RESET}"
+MSG_CHECK_PORT         = f"{GREEN}>>> Checking for leftover processes on port 4729...{RESET}"
+MSG_NO_PORT_TOOL       = f"{RED}/proc/net, ss and lsof unavailable; cannot check leftover processes. Skipping...{RESET}"
+MSG_CHECK_DEPS         = f"{GREEN}>>> Checking Dependencies...{RESET}"
+MSG_MISSING_PKGS       = f"{RED}Missing packages:{RESET}"
+MSG_INSTALL_PROMPT     = f"{BOLD}Install them now via apt-get? [y/N]: {RESET}"
+MSG_PICK_DEVICE        = f"{GREEN}>>> Choose your weapon (SDR Device){RESET}"
+MSG_DEVICE_CHOSEN      = f"{GREEN}Device chosen:{RESET}"
+MSG_SCANNING           = f"{GREEN}>>> Scanning GSM Band...{RESET}"
+MSG_NO_SCANNER         = f"{RED}grgsm_scanner not found!{RESET} Is gr-gsm installed properly?"
+MSG_FOUND              = f"{GREEN}Found:{RESET} "
+MSG_SCANNER_STDERR     = f"{RED}[grgsm_scanner stderr]:{RESET}"
+MSG_ARFCNS_FOUND       = f"{GREEN}\n>>> ARFCNs discovered:{RESET}"
+MSG_OVERRIDE           = f"{GREEN}>>> Frequency/ARFCN override (optional){RESET}"
+MSG_INVALID_FREQ       = f"{RED}Invalid frequency/ARFCN format! Exiting.{RESET}"
+MSG_NO_HEADLESS        = f"{RED}grgsm_livemon_headless not found!{RESET} Falling back to 'grgsm_livemon -p'."
+MSG_LIVEMON_START      = f"{GREEN}>>> Starting grgsm_livemon (headless) in bg...{RESET}"
+MSG_TSHARK_START       = f"{GREEN}>>> Launching TShark...{RESET}\n"
+MSG_TSHARK_INTERRUPTED = f"{RED}\nTShark interrupted by user.{RESET}"
+MSG_TSHARK_STDERR      = f"{RED}[TShark stderr]:{RESET}"
+MSG_NO_TSHARK          = f"{RED}tshark not found!{RESET} Is it installed and in your PATH?"
+MSG_LIVEMON_STOP       = f"{RED}\nTerminating grgsm_livemon...{RESET}"
+MSG_DONE               = f"{GREEN}All done. Stay safe out there!{RESET}\n"
+
+# Separator for the flat "MCC<sep>MNC" lookup keys (ASCII unit separator)
+MCC_MNC_SEP = "\x1f"
+
+# Captured rows are flushed as soon as no more are queued, and at least
+# every TSHARK_FLUSH_EVERY rows during a burst
+TSHARK_FLUSH_EVERY = 32
+
+# Kernel buffer for the TShark stdout pipe (default is 64 KB). Sizes above
+# /proc/sys/fs/pipe-max-size (1 MB by default) need root or a raised limit.
+TSHARK_PIPE_SIZE = 1 << 20
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+# Read size for the TShark pipe (opened in binary mode and drained with
+# read1): one read() takes up to this much of whatever is queued, instead
+# of the 8 KB chunks a text-mode pipe reads.
+TSHARK_READ_SIZE = 1 << 16
+
 
 # ---------------------------------------------------------------------
 # 1) CSV LOADER for MCC/MNC
 # ---------------------------------------------------------------------
 def load_mcc_mnc_csv(csv_filename):
     """
-    Load a CSV file of MCC/MNC records, returning a dict keyed by (MCC, MNC).
+    Load a CSV file of MCC/MNC records, returning a mapping keyed by
+    MCC + MCC_MNC_SEP + MNC (a single string, so lookups hash no tuples).
     The CSV must have columns: Country,Network,MCC,MNC
+
+    The result is returned as a read-only MappingProxyType, since it is
+    never modified after loading.
     """
     lookup_dict = {}
 
     if not os.path.isfile(csv_filename):
         print(f"{RED}CSV file '{csv_filename}' not found!{RESET} Skipping MCC/MNC lookup.\n")
-        return lookup_dict
+        return types.MappingProxyType(lookup_dict)
 
     try:
         with open(csv_filename, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+            reader = csv.reader(f)
+            header = [col.strip() for col in next(reader, [])]
+            try:
+                ci, ni, mcci, mnci = map(header.index, ("Country", "Network", "MCC", "MNC"))
+            except ValueError:
+                print(f"{RED}CSV '{csv_filename}' lacks Country,Network,MCC,MNC columns!{RESET} Skipping MCC/MNC lookup.\n")
+                return types.MappingProxyType(lookup_dict)
+
+            # Interned: country/network names repeat across many rows
+            intern = sys.intern
+            width = max(ci, ni, mcci, mnci)
             for row in reader:
-                try:
-                    country = row['Country'].strip()
-                    network = row['Network'].strip()
-                    mcc = row['MCC'].strip()
-                    mnc = row['MNC'].strip()
-                    lookup_dict[(mcc, mnc)] = (country, network)
-                except KeyError:
-                    continue  # missing columns, skip
+                if len(row) <= width:
+                    continue  # short row, skip
+                key = intern(row[mcci].strip() + MCC_MNC_SEP + row[mnci].strip())
+                lookup_dict[key] = (intern(row[ci].strip()), intern(row[ni].strip()))
     except Exception as e:
         print(f"{RED}Error reading CSV '{csv_filename}': {e}{RESET}\n")
+        return types.MappingProxyType(lookup_dict)
 
-    return lookup_dict
+    return types.MappingProxyType(lookup_dict)
 
 
 # ---------------------------------------------------------------------
@@ -67,30 +150,117 @@ def load_mcc_mnc_csv(csv_filename):
 # ---------------------------------------------------------------------
 def print_banner():
     """ Hacker-style ASCII banner. """
-    print(f"{BOLD}{GREEN}")
-    print("Evade the matrix. Sniff IMSI. Let's go...\n")
-    print(RESET, end="")
+    print(MSG_BANNER, end="")
 
-def kill_leftover_processes():
+PROC_NET_TABLES = ("/proc/net/udp", "/proc/net/udp6", "/proc/net/tcp", "/proc/net/tcp6")
+
+
+def find_port_socket_inodes(port):
     """
-    Kills leftover processes that bind to port 4729.
+    Return the inodes of TCP/UDP sockets with `port` on either end, read
+    straight from /proc/net/{udp,tcp}[6]. Returns None if /proc/net is
+    unavailable.
     """
-    print(f"{GREEN}>>> Checking for leftover processes on port 4729...{RESET}")
-    check_cmd = ["lsof", "-i", ":4729"]
+    inodes = set()
+    found_table = False
+    for table in PROC_NET_TABLES:
+        try:
+            with open(table, mode='r') as f:
+                found_table = True
+                next(f, None)  # column header
+                for line in f:
+                    # sl local_address rem_address st ... uid timeout inode
+                    fields = line.split()
+                    if len(fields) < 10 or fields[9] == "0":
+                        continue
+                    local_port = int(fields[1].rpartition(":")[2], 16)
+                    remote_port = int(fields[2].rpartition(":")[2], 16)
+                    if port in (local_port, remote_port):
+                        inodes.add(fields[9])
+        except OSError:
+            continue
+    return inodes if found_table else None
+
+
+def find_socket_pids(inodes):
+    """
+    Map socket inodes back to the PIDs holding them by walking /proc/<pid>/fd.
+    """
+    pids = []
+    if not inodes:
+        return pids
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with os.scandir(f"/proc/{pid}/fd") as fds:
+                for entry in fds:
+                    try:
+                        if os.readlink(entry.path) in targets:
+                            pids.append(pid)
+                            break
+                    except OSError:
+                        continue  # fd closed meanwhile
+        except OSError:
+            continue  # process gone or not ours to inspect
+    return pids
+
+
+def find_port_pids(port):
+    """
+    Return the PIDs of processes holding a TCP/UDP socket on the given port.
+    Reads /proc/net and /proc/<pid>/fd directly; if /proc/net is unavailable,
+    queries 'ss' (netlink), then 'lsof'. Returns None if nothing works.
+    """
+    inodes = find_port_socket_inodes(port)
+    if inodes is not None:
+        return find_socket_pids(inodes)
+
+    ss_cmd = ["ss", "-H", "-a", "-p", "-t", "-u", "-n",
+              f"( sport = :{port} or dport = :{port} )"]
     try:
-        result = subprocess.run(check_cmd, capture_output=True, text=True, check=False)
+        result = subprocess.run(ss_cmd, capture_output=True, text=True, check=False)
+        # users:(("grgsm_livemon",pid=1234,fd=5))
+        pids = re.findall(r"pid=(\d+)", result.stdout)
+        return list(dict.fromkeys(pids))
     except FileNotFoundError:
-        print(f"{RED}lsof not found; cannot check leftover processes. Skipping...{RESET}")
-        return
+        pass
+
+    try:
+        result = subprocess.run(["lsof", "-i", f":{port}"], capture_output=True, text=True, check=False)
+    except FileNotFoundError:
+        return None
 
+    pids = []
     lines = result.stdout.strip().split("\n")
     if len(lines) > 1 and "PID" in lines[0]:
         for line in lines[1:]:
             parts = line.split()
-            if len(parts) >= 2:
-                pid = parts[1]
-                print(f"{RED}Killing leftover process PID={pid} using port 4729!{RESET}")
-                subprocess.run(["sudo", "kill", "-9", pid], check=False)
+            if len(parts) >= 2 and parts[1] not in pids:
+                pids.append(parts[1])
+    return pids
+
+
+def kill_leftover_processes():
+    """
+    Kills leftover processes that bind to port 4729.
+    """
+    print(MSG_CHECK_PORT)
+    pids = find_port_pids(4729)
+    if pids is None:
+        print(MSG_NO_PORT_TOOL)
+        return
+
+    if pids:
+        for pid in pids:
+            print(f"{RED}Killing leftover process PID={pid} using port 4729!{RESET}")
+            try:
+                os.kill(int(pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass  # already gone
+            except PermissionError:
+                print(f"{RED}Not permitted to kill PID={pid}; run this script with sudo.{RESET}")
         print()
     else:
         print("No leftover processes found.\n")
@@ -100,18 +270,22 @@ def check_or_install_deps():
     """
     Checks or installs python3, gr-gsm, tshark.
     """
-    print(f"{GREEN}>>> Checking Dependencies...{RESET}")
+    print(MSG_CHECK_DEPS)
     packages = ["python3", "gr-gsm", "tshark"]
-    missing = []
-    for pkg in packages:
-        cmd = ["dpkg", "-s", pkg]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        if result.returncode != 0:
-            missing.append(pkg)
+
+    # One dpkg-query for all packages; unknown ones only show up on stderr
+    cmd = ["dpkg-query", "-W", "-f=${Package}\t${db:Status-Status}\n"] + packages
+    result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    installed = set()
+    for line in result.stdout.splitlines():
+        name, _, status = line.partition("\t")
+        if status == "installed":
+            installed.add(name)
+    missing = [pkg for pkg in packages if pkg not in installed]
 
     if missing:
-        print(f"{RED}Missing packages:{RESET} {missing}")
-        ans = input(f"{BOLD}Install them now via apt-get? [y/N]: {RESET}").strip().lower()
+        print(MSG_MISSING_PKGS, missing)
+        ans = input(MSG_INSTALL_PROMPT).strip().lower()
         if ans == "y":
             subprocess.run(["sudo", "apt-get", "update"], check=False)
             install_cmd = ["sudo", "apt-get", "install", "-y"] + missing
@@ -122,6 +296,61 @@ def check_or_install_deps():
     else:
         print("All required packages found!\n")
 
+def start_line_pump(stream, read_size=None):
+    """
+    Drain `stream` (text or binary) line by line on a daemon thread into a
+    SimpleQueue, so parsing/printing never stalls the child's pipe.
+    A None entry marks EOF.
+
+    With read_size, `stream` must be a binary buffered reader: it is drained
+    with read1(read_size), i.e. one read() of up to read_size bytes of
+    whatever is queued, and the lines are queued decoded as UTF-8 text.
+    """
+    lines = queue.SimpleQueue()
+
+    def produce():
+        try:
+            if read_size is None:
+                for line in stream:
+                    lines.put(line)
+                return
+            partial = b""
+            while True:
+                chunk = stream.read1(read_size)
+                if not chunk:
+                    break
+                # A UTF-8 sequence never contains b"\n", so each line decodes alone
+                *complete, partial = (partial + chunk).split(b"\n")
+                for line in complete:
+                    lines.put(line.decode("utf-8", "replace") + "\n")
+            if partial:
+                lines.put(partial.decode("utf-8", "replace"))
+        except (OSError, ValueError):
+            pass  # pipe closed under us
+        finally:
+            lines.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return lines
+
+
+def pump_lines(stream):
+    """
+    Iterator over the lines of `stream`, read ahead by start_line_pump().
+    """
+    return iter(start_line_pump(stream).get, None)
+
+
+def read_spooled_stderr(stderr_file):
+    """
+    Read back (and close) the temporary file a child wrote its stderr to.
+    Unlike stderr=PIPE, nothing can fill up and stall the child while only
+    its stdout is being read.
+    """
+    with stderr_file:
+        stderr_file.seek(0)
+        return stderr_file.read().decode("utf-8", "replace").strip()
+
 
 # ---------------------------------------------------------------------
 # 3) Device Selection
@@ -131,7 +360,7 @@ def pick_device():
     User picks device from [RTL-SDR, HackRF, BladeRF].
     Returns dev arg: "rtl", "hackrf", "bladerf".
     """
-    print(f"{GREEN}>>> Choose your weapon (SDR Device){RESET}")
+    print(MSG_PICK_DEVICE)
     devices = [
         ("RTL-SDR",  "rtl"),
         ("HackRF",   "hackrf"),
@@ -150,7 +379,7 @@ def pick_device():
         sys.exit(1)
 
     selected = devices[idx]
-    print(f"{GREEN}Device chosen:{RESET} {selected[0]}\n")
+    print(MSG_DEVICE_CHOSEN, f"{selected[0]}\n")
     return selected[1]
 
 
@@ -162,29 +391,62 @@ def parse_arfcn_or_freq(arfcn_str):
     Parse a user input that may be 'ARFCN=123' or a frequency like '925.2M'.
     Returns (arfcn, freq_str).
     """
-    arfcn_pattern = re.compile(r"^ARFCN=(\d+)$", re.IGNORECASE)
-    freq_pattern = re.compile(r"^\d+(\.\d+)?[MG]$", re.IGNORECASE)
+    s = arfcn_str.upper()
 
-    match_arfcn = arfcn_pattern.match(arfcn_str)
-    if match_arfcn:
-        return match_arfcn.group(1), None
+    # ARFCN=<digits>
+    if s.startswith("ARFCN=") and s[6:].isdecimal():
+        return s[6:], None
 
-    match_freq = freq_pattern.match(arfcn_str)
-    if match_freq:
-        return None, arfcn_str
+    # <digits>[.<digits>]M or ...G
+    if s[-1:] in ("M", "G"):
+        whole, dot, frac = s[:-1].partition(".")
+        if whole.isdecimal() and (not dot or frac.isdecimal()):
+            return None, arfcn_str
 
     return None, None
 
+def build_arfcn_table():
+    """
+    Precompute GSM downlink frequencies (MHz) indexed by ARFCN (0-1023),
+    per the 3GPP TS 45.005 band plan. Unassigned ARFCNs stay 0.0.
+    ARFCNs 512-810 are shared by DCS1800 and PCS1900; DCS1800 is used.
+    """
+    table = array.array('d', [0.0]) * 1024
+    bands = [
+        # (first ARFCN, last ARFCN, DL MHz at first ARFCN)
+        (0,   124,  935.0),   # P-GSM / E-GSM 900
+        (975, 1023, 925.2),   # E-GSM 900
+        (955, 974,  921.2),   # R-GSM 900
+        (128, 251,  869.2),   # GSM 850
+        (259, 293,  460.6),   # GSM 450
+        (306, 340,  489.0),   # GSM 480
+        (512, 885,  1805.2),  # DCS 1800
+    ]
+    for first, last, base in bands:
+        for n in range(first, last + 1):
+            table[n] = round(base + 0.2 * (n - first), 1)
+    return table
+
+
+ARFCN_DL_MHZ = build_arfcn_table()
+
+# Downlink span of every band above (GSM 450 up to PCS 1900), in MHz
+GSM_DL_MIN_MHZ = 450.0
+GSM_DL_MAX_MHZ = 2000.0
+
+
 def convert_arfcn_to_freq(arfcn):
     """
-    Simple, naive ARFCN -> Frequency conversion for demonstration.
-    Adjust for a real GSM band plan as needed.
+    ARFCN -> downlink frequency string (e.g. '975' -> '925.2M'),
+    looked up in the precomputed ARFCN_DL_MHZ table.
     """
-    if arfcn.isdigit():
-        freq_mhz = 900.0 + (int(arfcn) * 0.2)
-        return f"{freq_mhz}M"
-    else:
-        raise ValueError(f"Invalid ARFCN: {arfcn}")
+    try:
+        n = int(arfcn, 10)
+    except ValueError:
+        n = -1
+    if 0 <= n < len(ARFCN_DL_MHZ) and ARFCN_DL_MHZ[n]:
+        return f"{ARFCN_DL_MHZ[n]:g}M"
+    raise ValueError(f"Invalid ARFCN: {arfcn}")
 
 
 # ---------------------------------------------------------------------
@@ -194,53 +456,50 @@ def scan_for_channels(device_arg, mcc_mnc_dict):
     """
     Runs 'grgsm_scanner --args <device_arg>' and parses lines including
     ARFCN, Freq, CID, LAC, MCC, MNC, Pwr. Also does a CSV lookup to display
-    Country/Network if (MCC, MNC) is in mcc_mnc_dict.
+    Country/Network if the MCC/MNC pair is in mcc_mnc_dict.
 
     Returns a list of (arfcn, freq).
     """
-    print(f"{GREEN}>>> Scanning GSM Band...{RESET}")
+    print(MSG_SCANNING)
     cmd = ["grgsm_scanner", "--args", device_arg]
     print(f"Command: {' '.join(cmd)}")
     print("(Ctrl+C to abort scanning early)\n")
 
+    # stderr is only checked once the scan ends, so spool it to a file
+    stderr_file = tempfile.TemporaryFile()
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
     except FileNotFoundError:
-        print(f"{RED}grgsm_scanner not found!{RESET} Is gr-gsm installed properly?")
+        stderr_file.close()
+        print(MSG_NO_SCANNER)
         sys.exit(1)
 
     channels = []
 
-    # Matches lines like:
-    #   Found: ARFCN:  975, Freq:  925.2M, CID: 38001, LAC: 30412, MCC: 655, MNC:  10, Pwr: -26
-    regex = re.compile(
-        r"ARFCN:\s+(\d+),\s+Freq:\s+([\d\.]+[MG]),\s+CID:\s+(\d+),"
-        r"\s+LAC:\s+(\d+),\s+MCC:\s+(\d+),\s+MNC:\s+(\d+),\s+Pwr:\s+(-?\d+)"
-    )
-
     try:
-        for line in process.stdout:
-            line_s = line.strip()
-            match = regex.search(line_s)
+        for line in pump_lines(process.stdout):
+            pos = line.find(SCANNER_NEEDLE)
+            if pos < 0:
+                continue
+            match = SCANNER_LINE_RE.match(line, pos)
             if match:
-                arfcn = match.group(1)
-                freq  = match.group(2)
-                cid   = match.group(3)
-                lac   = match.group(4)
-                mcc   = match.group(5)
-                mnc   = match.group(6)
-                pwr   = match.group(7)
+                fields = match.groupdict()
+                arfcn = fields["arfcn"].decode("ascii")
+                freq  = fields["freq"].decode("ascii")
+                cid   = fields["cid"].decode("ascii")
+                lac   = fields["lac"].decode("ascii")
+                mcc   = fields["mcc"].decode("ascii")
+                mnc   = fields["mnc"].decode("ascii")
+                pwr   = fields["pwr"].decode("ascii")
 
                 channels.append((arfcn, freq))
 
                 # Lookup in CSV
-                country_str, network_str = ("", "")
-                if (mcc, mnc) in mcc_mnc_dict:
-                    country_str, network_str = mcc_mnc_dict[(mcc, mnc)]
+                country_str, network_str = mcc_mnc_dict.get(mcc + MCC_MNC_SEP + mnc, ("", ""))
 
                 # Print extended info
                 print(
-                    f"{GREEN}Found:{RESET} "
+                    MSG_FOUND +
                     f"ARFCN: {arfcn}, Freq: {freq}, CID: {cid}, LAC: {lac}, "
                     f"MCC: {mcc}, MNC: {mnc}, Pwr: {pwr}, "
                     f"[Country={country_str}, Network={network_str}]"
@@ -249,9 +508,9 @@ def scan_for_channels(device_arg, mcc_mnc_dict):
         print("Scan aborted by user.\n")
 
     process.wait()
-    err = process.stderr.read().strip()
+    err = read_spooled_stderr(stderr_file)
     if err:
-        print(f"{RED}[grgsm_scanner stderr]:{RESET} {err}")
+        print(MSG_SCANNER_STDERR, err)
         if "Address already in use" in err:
             print("Port 4729 locked. Exiting.\n")
             sys.exit(1)
@@ -268,7 +527,7 @@ def pick_channel(channels):
         print("No channels found. Exiting.\n")
         sys.exit(0)
 
-    print(f"{GREEN}\n>>> ARFCNs discovered:{RESET}")
+    print(MSG_ARFCNS_FOUND)
     for i, (arfcn, freq) in enumerate(channels, start=1):
         print(f"{i}) ARFCN={arfcn}, Frequency={freq}")
 
@@ -291,7 +550,7 @@ def pick_frequency_or_scan(device_arg, mcc_mnc_dict):
     Prompt for manual freq or ARFCN override. If blank, run scan_for_channels().
     Return the final frequency string.
     """
-    print(f"{GREEN}>>> Frequency/ARFCN override (optional){RESET}")
+    print(MSG_OVERRIDE)
     print("If you already know the frequency or ARFCN, enter it now (e.g., '925.2M' or 'ARFCN=123').")
     print("Press Enter to skip and perform a full scan.\n")
 
@@ -306,7 +565,7 @@ def pick_frequency_or_scan(device_arg, mcc_mnc_dict):
     # parse
     user_arfcn, user_freq = parse_arfcn_or_freq(user_input)
     if user_arfcn is None and user_freq is None:
-        print(f"{RED}Invalid frequency/ARFCN format! Exiting.{RESET}")
+        print(MSG_INVALID_FREQ)
         sys.exit(1)
 
     if user_arfcn:
@@ -318,6 +577,12 @@ def pick_frequency_or_scan(device_arg, mcc_mnc_dict):
             print(f"{RED}{ex}{RESET}")
             sys.exit(1)
     else:
+        # Reject out-of-band input here rather than after launching grgsm
+        freq_mhz = float(user_freq[:-1]) * (1000 if user_freq[-1] in "Gg" else 1)
+        if not GSM_DL_MIN_MHZ <= freq_mhz <= GSM_DL_MAX_MHZ:
+            print(f"{RED}Frequency {user_freq} is outside the GSM downlink bands "
+                  f"({GSM_DL_MIN_MHZ:g}-{GSM_DL_MAX_MHZ:g} MHz)! Exiting.{RESET}")
+            sys.exit(1)
         print(f"{GREEN}Using provided frequency={user_freq}{RESET}\n")
         return user_freq
 
@@ -330,62 +595,189 @@ def run_livemon_headless(device_arg, freq_str):
     Try 'grgsm_livemon_headless' or fallback to 'grgsm_livemon -p'.
     freq_str "925.2M" -> "925.2e6".
     """
-    freq_e = freq_str.replace("M", "e6").replace("G", "e9")
+    suffix = freq_str[-1:]
+    if suffix not in ("M", "m", "G", "g"):
+        print(f"{RED}Invalid frequency '{freq_str}' (expected e.g. 925.2M)!{RESET} Aborting.")
+        sys.exit(1)
+    freq_e = freq_str[:-1] + ("e6" if suffix in ("M", "m") else "e9")
 
     cmd_name = "grgsm_livemon_headless"
-    check_cmd = ["which", cmd_name]
-    result = subprocess.run(check_cmd, capture_output=True, text=True, check=False)
 
-    if result.returncode != 0:
-        print(f"{RED}grgsm_livemon_headless not found!{RESET} Falling back to 'grgsm_livemon -p'.")
+    if shutil.which(cmd_name) is None:
+        print(MSG_NO_HEADLESS)
         cmd_name = "grgsm_livemon"
         fallback_flags = ["-p"]
         cmd = [cmd_name, "--args", device_arg, "-f", freq_e] + fallback_flags
     else:
         cmd = [cmd_name, "--args", device_arg, "-f", freq_e]
 
-    print(f"{GREEN}>>> Starting grgsm_livemon (headless) in bg...{RESET}")
+    print(MSG_LIVEMON_START)
     print("Command:", " ".join(cmd))
     try:
         proc = subprocess.Popen(
             cmd,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
-            preexec_fn=os.setpgrp  # run in its own process group
+            start_new_session=True  # own session/process group, set up in C
         )
     except FileNotFoundError:
         print(f"{RED}{cmd_name} not found!{RESET} Aborting.")
         sys.exit(1)
 
-    time.sleep(2)
-    print("grgsm_livemon launched. If signal is poor, no data might appear.\n")
+    if wait_for_port_owner(proc, 4729):
+        print("grgsm_livemon launched. If signal is poor, no data might appear.\n")
+    else:
+        print(f"{RED}grgsm_livemon has no socket on UDP/4729 yet;{RESET} continuing anyway.\n")
     return proc
 
 
+def wait_for_port_owner(proc, port, timeout=5.0, interval=0.01, max_interval=0.1):
+    """
+    Poll /proc/net until a process in proc's process group holds a socket on
+    `port`, proc exits, or `timeout` seconds pass. Returns True once ready.
+
+    The poll interval doubles from `interval` up to `max_interval`, and the
+    /proc/<pid>/fd walk that resolves a socket's owner only runs when new
+    inodes for `port` show up, not on every tick.
+    """
+    deadline = time.monotonic() + timeout
+    checked = set()
+    while proc.poll() is None:
+        inodes = find_port_socket_inodes(port)
+        if inodes is None:
+            # No /proc/net to probe: fall back to a fixed warm-up
+            time.sleep(2)
+            return True
+        new_inodes = inodes - checked
+        if new_inodes:
+            checked |= new_inodes
+            for pid in find_socket_pids(new_inodes):
+                try:
+                    if os.getpgid(int(pid)) == proc.pid:
+                        return True
+                except ProcessLookupError:
+                    continue
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    return False
+
+
+def stop_process_group(proc, grace=2.0):
+    """
+    SIGTERM the whole process group led by proc, escalating to SIGKILL
+    if it has not exited after `grace` seconds.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=grace)
+    except ProcessLookupError:
+        pass  # group already gone
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proc.wait()
+
+
+@contextlib.contextmanager
+def livemon_running(device_arg, freq_str):
+    """
+    Run grgsm_livemon for the duration of the with-block, then tear down
+    its whole process group (also on Ctrl+C or errors).
+    """
+    proc = run_livemon_headless(device_arg, freq_str)
+    try:
+        yield proc
+    finally:
+        print(MSG_LIVEMON_STOP)
+        stop_process_group(proc)
+
+
 # ---------------------------------------------------------------------
 # 7) TShark + CSV Lookup
 # ---------------------------------------------------------------------
-def parse_tshark_csv_line(tshark_line):
+def relay_tshark_rows(stream, mcc_mnc_dict):
     """
-    Parse a CSV line from TShark using Python's csv module.
+    Re-emit TShark CSV rows from `stream` (TShark's binary stdout) to stdout
+    with Country/Network columns appended from mcc_mnc_dict.
     """
-    import io
-    reader = csv.reader(io.StringIO(tshark_line), quotechar='"', delimiter=',')
-    for row in reader:
-        return row
-    return []
+    # One C-level reader fed by the pipe-draining thread; no per-line
+    # StringIO/reader churn
+    lines = start_line_pump(stream, TSHARK_READ_SIZE)
+    reader = csv.reader(iter(lines.get, None), delimiter=',', quotechar='"')
+
+    # csv.writer re-quotes every field (doubling embedded quotes), writing
+    # into a block-buffered UTF-8 wrapper around the byte stream so rows
+    # are flushed per burst, not per line
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace', newline='')
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writerow = writer.writerow
+    flush = out.flush
+    pending = 0
+
+    try:
+        # Print header with appended columns
+        header = next(reader, None)
+        if header:
+            writerow(header + ["Country", "Network"])
+            flush()
+
+        for row in reader:
+            if not row:
+                continue
+
+            # Indices:
+            # 0: frame.time
+            # 1: e212.imsi
+            # 2: e212.mcc
+            # 3: e212.mnc
+            # 4: gsm_a.tmsi
+            # 5: gsm_a.lac
+            # 6: gsm_sms.sms_text
+            # 7: gsm_a.imei
+            # 8: gsm_a.imeisv
+
+            mcc_val = row[2] if len(row) > 2 else ""
+            mnc_val = row[3] if len(row) > 3 else ""
+
+            country_str = ""
+            network_str = ""
+
+            if mcc_val and mnc_val:
+                hit = mcc_mnc_dict.get(sys.intern(mcc_val + MCC_MNC_SEP + mnc_val))
+                if hit:
+                    country_str, network_str = hit
+
+            # Re-emit the row + appended Country/Network columns
+            row.append(country_str)
+            row.append(network_str)
+            writerow(row)
+
+            # One write() per burst: flush once the backlog is drained
+            pending += 1
+            if pending >= TSHARK_FLUSH_EVERY or lines.empty():
+                flush()
+                pending = 0
+    finally:
+        flush()
+        out.detach()  # leave sys.stdout.buffer open
 
 
 def run_tshark_capture(mcc_mnc_dict):
     """
     TShark line-buffered capturing IMSI, MCC, MNC, TMSI, LAC, SMS, IMEI, IMEISV.
-    Append country/network if MCC/MNC found in mcc_mnc_dict.
+    Append country/network if MCC/MNC found in mcc_mnc_dict (the columns
+    are always present, left empty when there is no match or no CSV).
     """
-    print(f"{GREEN}>>> Launching TShark...{RESET}\n")
+    print(MSG_TSHARK_START)
     cmd = [
         "tshark",
         "-i", "lo",
         "-f", "port 4729 and not icmp and udp",
+        "-n",  # no name resolution: it only costs per-packet lookups on lo
         "-l",
         "-Y", "(e212.imsi or e212.mcc or e212.mnc or gsm_a.tmsi or gsm_a.lac or gsm_sms.sms_text or gsm_a.imei or gsm_a.imeisv)",
         "-T", "fields",
@@ -404,54 +796,32 @@ def run_tshark_capture(mcc_mnc_dict):
     ]
     print("Command:", " ".join(cmd), "\n")
 
+    # stderr is only printed once TShark exits, so spool it to a file
+    stderr_file = tempfile.TemporaryFile()
     try:
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1) as proc:
-            # Print header with appended columns
-            header_line = proc.stdout.readline().rstrip('\n')
-            if header_line:
-                print(f"{header_line},\"Country\",\"Network\"")
-
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file,
+                              bufsize=TSHARK_READ_SIZE) as proc:
+            # Bigger pipe absorbs capture bursts while Python is busy formatting
             try:
-                for line in proc.stdout:
-                    line_str = line.strip('\n')
-                    if not line_str:
-                        continue
-
-                    csv_fields = parse_tshark_csv_line(line_str)
-                    # Indices:
-                    # 0: frame.time
-                    # 1: e212.imsi
-                    # 2: e212.mcc
-                    # 3: e212.mnc
-                    # 4: gsm_a.tmsi
-                    # 5: gsm_a.lac
-                    # 6: gsm_sms.sms_text
-                    # 7: gsm_a.imei
-                    # 8: gsm_a.imeisv
-
-                    mcc_val = csv_fields[2] if len(csv_fields) > 2 else ""
-                    mnc_val = csv_fields[3] if len(csv_fields) > 3 else ""
-
-                    country_str = ""
-                    network_str = ""
-
-                    if mcc_val and mnc_val and (mcc_val, mnc_val) in mcc_mnc_dict:
-                        country_str, network_str = mcc_mnc_dict[(mcc_val, mnc_val)]
-
-                    # Print original line + appended CSV
-                    print(f"{line_str},\"{country_str}\",\"{network_str}\"")
+                fcntl.fcntl(proc.stdout.fileno(), F_SETPIPE_SZ, TSHARK_PIPE_SIZE)
+            except OSError:
+                pass  # keep the default pipe size
 
+            sys.stdout.flush()
+            try:
+                relay_tshark_rows(proc.stdout, mcc_mnc_dict)
             except KeyboardInterrupt:
-                print(f"{RED}\nTShark interrupted by user.{RESET}")
+                print(MSG_TSHARK_INTERRUPTED)
                 proc.terminate()
 
             proc.wait()
-            err = proc.stderr.read().strip()
+            err = read_spooled_stderr(stderr_file)
             if err:
-                print(f"{RED}[TShark stderr]:{RESET} {err}")
+                print(MSG_TSHARK_STDERR, err)
 
     except FileNotFoundError:
-        print(f"{RED}tshark not found!{RESET} Is it installed and in your PATH?")
+        stderr_file.close()
+        print(MSG_NO_TSHARK)
         sys.exit(1)
 
 
@@ -477,20 +847,11 @@ def main():
     # 6) Pick frequency or do scanning
     freq_str = pick_frequency_or_scan(dev_arg, mcc_mnc_dict)
 
-    # 7) Launch grgsm_livemon
-    livemon_proc = run_livemon_headless(dev_arg, freq_str)
-
-    # 8) Run TShark capture
-    run_tshark_capture(mcc_mnc_dict)
-
-    # 9) Kill livemon
-    print(f"{RED}\nTerminating grgsm_livemon...{RESET}")
-    try:
-        livemon_proc.terminate()
-    except Exception:
-        pass
+    # 7) Launch grgsm_livemon, 8) run TShark capture, 9) kill livemon
+    with livemon_running(dev_arg, freq_str):
+        run_tshark_capture(mcc_mnc_dict)
 
-    print(f"{GREEN}All done. Stay safe out there!{RESET}\n")
+    print(MSG_DONE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import importlib.util
+import os
+
+import raspberrypi_readiness as stage1
+from command_runner import APT_GET, apt_update_if_stale, install_apt_config, keep_sudo_alive
+
+# The stage-2 software script's file name isn't a valid module name,
+# so it is loaded from its path next to this script
+SOFTWARE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raspberrypi-software-readiness.py")
+
+def load_script(name, path):
+    """
+    Import a wizard script as a module without running its main().
+
+    :param name: Module name to register it under (string).
+    :param path: Path to the script (string).
+    :return: The loaded module.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def main():
+    software = load_script("raspberrypi_software_readiness", SOFTWARE_SCRIPT)
+
+    print("\n========== RASPBERRY PI 5 READINESS (STAGE 1 + STAGE 2 SOFTWARE) ==========")
+    print("This script runs stage 1 and the stage 2 software setup with a single apt transaction.\n")
+
+    # Ask for the sudo password once, up front
+    keep_sudo_alive()
+
+    ########################################################################
+    # 1. Install the wizard's apt settings & refresh package lists
+    ########################################################################
+    install_apt_config()
+    apt_update_if_stale()
+
+    ########################################################################
+    # 2. Install both stages' packages in one apt transaction
+    ########################################################################
+    packages = stage1.STAGE1_PACKAGES + [
+        pkg for pkg in software.SOFTWARE_PACKAGES if pkg not in stage1.STAGE1_PACKAGES
+    ]
+    print("\n[INFO] Installing all packages (xtrx-dkms is left out; gr-osmosdr works without it).")
+    software.install_packages(
+        packages,
+        "Installing Python3 tooling, GNU Radio, gr-osmosdr, gqrx-sdr, GR-GSM and Kalibrate-RTL dependencies"
+    )
+
+    ########################################################################
+    # 3. Upgrade the system (critical; once, after the installs) & autoremove
+    ########################################################################
+    software.run_command(
+        APT_GET + ["upgrade", "-y"],
+        "Upgrading the system",
+        exit_on_failure=True
+    )
+    # The .deb archive cache is kept so re-runs don't download everything again
+    software.run_command(
+        APT_GET + ["autoremove", "--purge", "-y"],
+        "Removing unnecessary packages"
+    )
+
+    ########################################################################
+    # 4. Stage 2 software tests, Kalibrate-RTL build & HackRF setup
+    #    (every apt step is already done)
+    ########################################################################
+    software.main(skip_apt=True)
+
+if __name__ == "__main__":
+    main()
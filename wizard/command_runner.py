@@ -0,0 +1,318 @@
+import filecmp
+import os
+import selectors
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+# sudo resolved once, so each privileged command execs it directly instead of
+# walking PATH
+SUDO = shutil.which("sudo") or "/usr/bin/sudo"
+
+# Non-interactive apt-get (sudo passes the VAR=value on to apt/debconf)
+# without translation downloads, dpkg pty handling or suggested packages.
+# Conffile prompts are answered per command (keep the local file, or take
+# the package default if it was never changed), so apt runs outside the
+# wizard keep their usual conffile handling.
+APT_SUDO = [SUDO, "DEBIAN_FRONTEND=noninteractive"]
+APT_OPTIONS = [
+    "-o", "Acquire::Languages=none", "-o", "Dpkg::Use-Pty=0", "-o", "APT::Install-Suggests=false",
+    "-o", "Dpkg::Options::=--force-confdef", "-o", "Dpkg::Options::=--force-confold",
+]
+APT_GET = APT_SUDO + ["apt-get"] + APT_OPTIONS
+APT_INSTALL = APT_GET + ["install", "-y", "--no-install-recommends"]
+
+# Touched by a successful 'apt-get update' (the stamp only where
+# update-notifier-common's hook is installed)
+APT_UPDATE_STAMPS = ["/var/lib/apt/periodic/update-success-stamp", "/var/lib/apt/lists"]
+
+# Package lists younger than this (seconds) are not refreshed again, e.g.
+# when one stage runs right after another
+APT_LISTS_MAX_AGE = 3600
+
+# apt settings shipped next to the wizard scripts, installed before apt runs
+APT_CONF_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "apt", "99sigintpi")
+APT_CONF_PATH = "/etc/apt/apt.conf.d/99sigintpi"
+
+# How often the sudo credential cache is refreshed (sudo's default timeout is 15 min)
+SUDO_REFRESH_INTERVAL = 60
+
+# Set once keep_sudo_alive() has started its refresh thread
+SUDO_KEEPALIVE_STARTED = threading.Event()
+
+def keep_sudo_alive(interval=SUDO_REFRESH_INTERVAL):
+    """
+    Ask for the sudo password once up front ('sudo -v'), then refresh sudo's
+    credential cache from a daemon thread, so long steps (builds, desktop
+    tests) never let it expire and later sudo calls never prompt mid-run.
+    Does nothing when already running as root, or if already started.
+
+    :param interval: Seconds between refreshes (int).
+    """
+    if os.geteuid() == 0 or SUDO_KEEPALIVE_STARTED.is_set():
+        return
+    try:
+        returncode = subprocess.run([SUDO, "-v"]).returncode
+    except FileNotFoundError:
+        returncode = 127
+    if returncode != 0:
+        print("[ERROR] Could not obtain sudo privileges; they are needed for almost every step.")
+        sys.exit(1)
+    SUDO_KEEPALIVE_STARTED.set()
+
+    def refresh():
+        while True:
+            time.sleep(interval)
+            # -n: never prompt from the background
+            subprocess.run([SUDO, "-n", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def run_streaming(argv, input_text=None, cwd=None):
+    """
+    Run a command, relaying its stdout/stderr to ours as they arrive, each
+    line indented by four spaces. Nothing is buffered beyond one read.
+
+    :param argv: Command to be executed (list of strings).
+    :param input_text: Optional text fed to the command's stdin (string).
+    :param cwd: Optional directory to run the command in (string).
+    :return: (return code, everything the command wrote to stderr as a string)
+    """
+    proc = subprocess.Popen(
+        argv,
+        cwd=cwd,
+        stdin=subprocess.PIPE if input_text is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if input_text is not None:
+        proc.stdin.write(input_text.encode())
+        proc.stdin.close()
+
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    stderr_data = bytearray()
+    at_line_start = True
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        selector.register(proc.stderr, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                if key.fileobj is proc.stderr:
+                    stderr_data += chunk
+                # Indent on newline boundaries only
+                if at_line_start:
+                    out.write(b"    ")
+                at_line_start = chunk.endswith(b"\n")
+                body = chunk[:-1] if at_line_start else chunk
+                out.write(body.replace(b"\n", b"\n    "))
+                if at_line_start:
+                    out.write(b"\n")
+            out.flush()
+    proc.stdout.close()
+    proc.stderr.close()
+    return proc.wait(), stderr_data.decode(errors="replace")
+
+def indent(text):
+    """
+    Indent every line of a command's output by four spaces.
+
+    :param text: Command output (string).
+    :return: The indented text, one string per line, or [] if text is blank.
+    """
+    # One rstrip(): blank output leaves nothing to split
+    return ["    " + line for line in text.rstrip().splitlines()]
+
+def run_command(argv, description=None, exit_on_failure=False, capture=False, stream=False,
+                input_text=None, stdout=None, cwd=None, recover=None, max_retries=1):
+    """
+    Run a command (no shell) and optionally exit if the command fails.
+    Shared by all wizard scripts, so fixes here apply to every stage.
+
+    :param argv: Command to be executed (list of strings).
+    :param description: Description shown before running the command (string).
+    :param exit_on_failure: If True, the script will exit if this command ultimately fails
+                            (with capture, that is left to print_report).
+    :param capture: If True, print nothing: the description, the command's stdout/stderr
+                    (indented) and the outcome are buffered into a report that is returned,
+                    for jobs that run alongside foreground steps (see print_report).
+    :param stream: If True, relay stdout/stderr back indented as they arrive (see
+                   run_streaming); otherwise the command writes straight to the terminal.
+    :param input_text: Optional text fed to the command's stdin (string).
+    :param stdout: Optional file descriptor the command's stdout is sent to (when not
+                   capturing or streaming).
+    :param cwd: Optional directory to run the command in (string).
+    :param recover: Optional callable given the failure reason (string); if it
+                    returns True the command is retried.
+    :param max_retries: How many times recover may trigger a retry (int).
+    :return: True if the command succeeded, False otherwise; with capture,
+             a (success, report string) tuple.
+    """
+    desc = description or " ".join(argv)
+    report = []
+    say = report.append if capture else print
+    success = False
+    for attempt in range(max_retries + 1):
+        if attempt:
+            say(f"[INFO] Retrying command: {desc}")
+        say(f"\n[+] {desc}")
+        sys.stdout.flush()
+        try:
+            if capture:
+                result = subprocess.run(argv, text=True, input=input_text, cwd=cwd,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                report.extend(indent(result.stdout))
+                returncode, stderr = result.returncode, result.stderr
+                if returncode == 0:
+                    report.extend(indent(stderr))
+            elif stream:
+                returncode, stderr = run_streaming(argv, input_text, cwd)
+            else:
+                returncode = subprocess.run(argv, text=True, input=input_text, stdout=stdout, cwd=cwd).returncode
+                stderr = ""
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, argv, stderr=stderr)
+            say(f"    [SUCCESS] {desc}")
+            success = True
+            break
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            stderr = (getattr(e, "stderr", None) or "").strip()
+            error_msg = stderr if stderr else str(e)
+            say(f"    [ERROR] {desc}\n      Reason: {error_msg}")
+        # Free the failed attempt's output before recovering and retrying
+        del stderr
+
+        if recover is None or attempt == max_retries or not recover(error_msg):
+            break
+
+    if capture:
+        return success, "\n".join(report) + "\n"
+    if not success and exit_on_failure:
+        sys.exit(1)
+    return success
+
+def print_report(result, exit_on_failure=False):
+    """
+    Print the buffered report of a run_command(capture=True) job, e.g. once
+    its future is joined, so it never interleaves with foreground output.
+
+    :param result: (success, report string) as returned with capture=True.
+    :param exit_on_failure: If True, the script will exit if the job failed.
+    :return: True if the job succeeded, False otherwise.
+    """
+    success, report = result
+    print(report, end="", flush=True)
+    if not success and exit_on_failure:
+        sys.exit(1)
+    return success
+
+def apt_update_if_stale(max_age=APT_LISTS_MAX_AGE, capture=False):
+    """
+    Run 'apt-get update' unless the package lists were refreshed within the
+    last max_age seconds (e.g. by a previous stage or a re-run of this one).
+
+    :param max_age: Maximum age of the package lists in seconds (int).
+    :param capture: If True, buffer the output instead of printing it and
+                    leave a failed update to the caller (see run_command).
+    :return: None; with capture, a (success, report string) tuple.
+    """
+    last_update = 0.0
+    for path in APT_UPDATE_STAMPS:
+        try:
+            last_update = max(last_update, os.stat(path).st_mtime)
+        except OSError:
+            continue
+    age = time.time() - last_update
+    if age < max_age:
+        message = f"\n[INFO] Package lists were refreshed {int(age)}s ago; skipping apt-get update."
+        if capture:
+            return True, message + "\n"
+        print(message)
+        return None
+    # Exit immediately if the update fails (when captured, the caller decides)
+    return run_command(
+        APT_GET + ["update", "-y"],
+        "Updating package lists",
+        exit_on_failure=not capture,
+        capture=capture
+    )
+
+def missing_packages(packages):
+    """
+    Return the packages (in order) that dpkg does not report as installed,
+    using a single dpkg-query call.
+
+    :param packages: Package names (list of strings).
+    :return: List of the package names that still need installing.
+    """
+    # Unknown packages only show up on stderr
+    cmd = ["dpkg-query", "-W", "-f=${Package}\t${db:Status-Status}\n"] + packages
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    except FileNotFoundError:
+        return list(packages)
+    installed = set()
+    for line in result.stdout.splitlines():
+        name, _, status = line.partition("\t")
+        if status == "installed":
+            installed.add(name)
+    return [pkg for pkg in packages if pkg not in installed]
+
+def install_root_file(src, dst, description=None):
+    """
+    Install a file shipped with the wizard as a root-owned, mode 0644 file.
+    When already running as root (e.g. under sudo) it is copied directly;
+    otherwise it goes through 'sudo install'.
+
+    :param src: Source file path (string).
+    :param dst: Destination file path (string).
+    :param description: Description shown before installing (string).
+    :return: True if the file was installed, False otherwise.
+    """
+    if os.geteuid() != 0:
+        return run_command([SUDO, "install", "-m", "0644", "-o", "root", "-g", "root", src, dst], description)
+
+    desc = description or f"Installing {dst}"
+    print(f"\n[+] {desc}")
+    try:
+        shutil.copyfile(src, dst)
+        os.chmod(dst, 0o644)
+    except OSError as e:
+        print(f"    [ERROR] {desc}\n      Reason: {e}")
+        return False
+    print(f"    [SUCCESS] {desc}")
+    return True
+
+def file_is_current(src, dst):
+    """
+    Check whether an installed file already matches the one shipped with
+    the wizard, so re-runs neither rewrite it nor redo the follow-up work.
+
+    :param src: File shipped with the wizard (string).
+    :param dst: Installed file path (string).
+    :return: True if dst exists with identical content, False otherwise.
+    """
+    try:
+        return filecmp.cmp(src, dst, shallow=False)
+    except OSError:
+        return False
+
+def install_apt_config():
+    """
+    Install the wizard's apt settings (download retries) unless the
+    installed copy already matches.
+
+    :return: True if the settings are in place, False if installing them failed.
+    """
+    if file_is_current(APT_CONF_SRC, APT_CONF_PATH):
+        return True
+    if install_root_file(APT_CONF_SRC, APT_CONF_PATH, f"Installing apt settings at {APT_CONF_PATH}"):
+        return True
+    print("[WARN] Continuing with apt's default settings.")
+    return False
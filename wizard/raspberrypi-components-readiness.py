@@ -1,7 +1,24 @@
+import argparse
+import ctypes
+import ctypes.util
+import shlex
 import subprocess
-import sys
 import time
 import os
+import pwd
+from concurrent.futures import ThreadPoolExecutor
+
+from command_runner import (
+    APT_GET, APT_INSTALL, SUDO, apt_update_if_stale, file_is_current, install_apt_config,
+    install_root_file, keep_sudo_alive, missing_packages, print_report, run_command,
+)
+
+# Optional: pyudev lets wait_for_device block on kernel hotplug events
+# instead of polling lsusb.
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
 
 # Common Vendor:Product IDs for RTL-SDR & HackRF.
 # Adjust if your specific dongles use different IDs.
@@ -10,48 +27,112 @@ DEVICE_IDS = {
     "HackRF": ["1d50:6089"],                        # HackRF
 }
 
+# The user who invoked the script (through sudo if used), looked up once
+ACTUAL_USER = os.environ.get("SUDO_USER") or pwd.getpwuid(os.getuid()).pw_name
+
+# udev rule files shipped next to this script
+UDEV_RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "udev")
+
 # Paths to udev rules we'll create if missing
 RTLSDR_RULES_PATH = "/etc/udev/rules.d/20-rtl-sdr.rules"
 HACKRF_RULES_PATH = "/etc/udev/rules.d/52-hackrf.rules"
 
-def run_command(command, description=None, exit_on_failure=False):
+# Test captures go to RAM (tmpfs) rather than the SD card when available
+CAPTURE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "."
+NESDR_CAPTURE_PATH = os.path.join(CAPTURE_DIR, "test_nesdr.bin")
+HACKRF_CAPTURE_PATH = os.path.join(CAPTURE_DIR, "test_hackrf.bin")
+
+# libusb hotplug constants (libusb.h)
+LIBUSB_CAP_HAS_HOTPLUG = 0x0001
+LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED = 0x01
+LIBUSB_HOTPLUG_ENUMERATE = 0x01  # also report devices already plugged in
+LIBUSB_HOTPLUG_MATCH_ANY = -1
+LIBUSB_HOTPLUG_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+
+# Seconds without a udev event after which wait_for_device_udev rescans sysfs
+UDEV_RESCAN_INTERVAL = 30
+
+# Fallback poll times (seconds since the prompt) for wait_for_device when no
+# hotplug events are available. Plug-in delay is modelled as log-normal
+# (mu=2.0, sigma=0.8; median ~7 s), and the times follow the optimal
+# inspection recurrence
+#     L_i = L_{i-1} + (F(L_{i-1}) - F(L_{i-2})) / p(L_{i-1}),   L_0 = 0, L_1 = 2
+# (p = density, F = CDF), so polls are densest where plug-ins are likeliest.
+# After the last entry the device is checked every POLL_INTERVAL seconds.
+POLL_SCHEDULE = [2.0, 2.8, 3.5, 4.2, 4.8, 5.5, 6.3, 7.0, 7.8, 8.6, 9.5]
+POLL_INTERVAL = 5
+
+# sysfs view of attached USB devices (one directory per device/interface)
+USB_SYSFS_PATH = "/sys/bus/usb/devices"
+
+# Packages installed by this stage
+BASE_PACKAGES = ["git", "build-essential", "cmake", "libusb-1.0-0-dev", "rtl-sdr"]
+HACKRF_PACKAGES = ["hackrf"]
+
+def capture_to_file(argv, path, size, description):
     """
-    Run a shell command and optionally exit if the command fails.
-    
-    :param command: Command to be executed (string).
+    Run an SDR capture command that writes its samples to stdout, with stdout
+    sent to `path`. The file is preallocated to `size` bytes first so it is laid
+    out in one contiguous extent (the tools' own fopen("wb") would truncate a
+    preallocated file), then cut back to what the command actually wrote.
+
+    :param argv: Capture command writing samples to stdout (list of strings).
+    :param path: Output file path (string).
+    :param size: Expected capture size in bytes (int).
     :param description: Description shown before running the command (string).
-    :param exit_on_failure: If True, the script will exit immediately on command failure.
+    :return: True if the capture succeeded, False otherwise.
     """
-    desc = description or command
-    print(f"\n[+] {desc}")
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout = result.stdout.strip()
-        if stdout:
-            print("    Output:")
-            print("    " + "\n    ".join(stdout.splitlines()))
-        print(f"    [SUCCESS] {desc}")
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.strip()
-        error_msg = stderr if stderr else str(e)
-        print(f"    [ERROR] {desc}\n      Reason: {error_msg}")
-        if exit_on_failure:
-            sys.exit(1)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    except OSError as e:
+        print(f"\n[+] {description}\n    [ERROR] {description}\n      Reason: {e}")
+        return False
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # filesystem without fallocate support; the file just grows
+        ok = run_command(argv, description, stdout=fd)
+        # The child shared our file offset, so it marks the end of the data
+        os.ftruncate(fd, os.lseek(fd, 0, os.SEEK_CUR))
+        return ok
+    finally:
+        os.close(fd)
+
+def scan_usb_ids():
+    """
+    Read the 'vvvv:pppp' IDs of every USB device from sysfs.
+
+    :return: Set of ID strings currently connected, or None without sysfs.
+    """
+    try:
+        entries = os.scandir(USB_SYSFS_PATH)
+    except OSError:
+        return None
+    ids = set()
+    with entries:
+        for entry in entries:
+            if ":" in entry.name:
+                continue  # interface entry (e.g. '1-1:1.0'), has no IDs
+            try:
+                with open(f"{entry.path}/idVendor") as fv, open(f"{entry.path}/idProduct") as fp:
+                    ids.add(f"{fv.read(4)}:{fp.read(4)}")
+            except OSError:
+                continue  # device gone meanwhile
+    return ids
 
 def is_device_plugged(device_id_list):
     """
-    Check via lsusb if at least one Vendor:Product ID in device_id_list is currently connected.
+    Check if at least one Vendor:Product ID in device_id_list is currently connected,
+    by reading idVendor/idProduct from sysfs (falls back to lsusb without sysfs).
 
     :param device_id_list: List of strings, each in 'vvvv:pppp' format (hex).
     :return: True if any matching device is found, False otherwise.
     """
+    ids = scan_usb_ids()
+    if ids is not None:
+        return any(device_id.lower() in ids for device_id in device_id_list)
+
     try:
         lsusb_output = subprocess.check_output(["lsusb"], text=True).strip().lower()
         for device_id in device_id_list:
@@ -61,23 +142,148 @@ def is_device_plugged(device_id_list):
         pass
     return False
 
+def load_libusb():
+    """
+    Load libusb-1.0 (installed in step 2) through ctypes, or return None if it
+    is missing or was built without hotplug support.
+    """
+    name = ctypes.util.find_library("usb-1.0") or "libusb-1.0.so.0"
+    try:
+        lib = ctypes.CDLL(name)
+    except OSError:
+        return None
+    lib.libusb_init.argtypes = [ctypes.POINTER(ctypes.c_void_p)]
+    lib.libusb_exit.argtypes = [ctypes.c_void_p]
+    lib.libusb_has_capability.argtypes = [ctypes.c_uint32]
+    lib.libusb_hotplug_register_callback.argtypes = [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+        LIBUSB_HOTPLUG_CALLBACK, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)
+    ]
+    lib.libusb_hotplug_deregister_callback.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.libusb_handle_events_completed.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+    if not lib.libusb_has_capability(LIBUSB_CAP_HAS_HOTPLUG):
+        return None
+    return lib
+
+def wait_for_device_libusb(device_name, device_id_list):
+    """
+    Block in libusb's event loop until a USB device whose ID is in
+    device_id_list arrives (devices already plugged in are reported at once).
+
+    :param device_name: Descriptive name of the device (string).
+    :param device_id_list: List of IDs (strings) in 'vvvv:pppp' format.
+    :return: True once the device is present, False if libusb hotplug is unavailable.
+    """
+    lib = load_libusb()
+    if lib is None:
+        return False
+    context = ctypes.c_void_p()
+    if lib.libusb_init(ctypes.byref(context)) != 0:
+        return False
+
+    done = ctypes.c_int(0)
+
+    def on_arrival(ctx, device, event, user_data):
+        done.value = 1
+        return 0
+
+    callback = LIBUSB_HOTPLUG_CALLBACK(on_arrival)  # must outlive the loop
+    handles = []
+    try:
+        for device_id in device_id_list:
+            vendor, product = (int(part, 16) for part in device_id.split(":"))
+            handle = ctypes.c_int()
+            if lib.libusb_hotplug_register_callback(
+                context, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED, LIBUSB_HOTPLUG_ENUMERATE,
+                vendor, product, LIBUSB_HOTPLUG_MATCH_ANY, callback, None, ctypes.byref(handle)
+            ) != 0:
+                return False
+            handles.append(handle.value)
+
+        if not done.value:
+            print(f"    [WAITING] {device_name} not detected yet... Waiting for it to be plugged in.")
+        while not done.value:
+            lib.libusb_handle_events_completed(context, ctypes.byref(done))
+        print(f"[INFO] {device_name} is now detected via USB.")
+        return True
+    finally:
+        for handle in handles:
+            lib.libusb_hotplug_deregister_callback(context, handle)
+        lib.libusb_exit(context)
+
+def usb_device_id(device):
+    """
+    Return the 'vvvv:pppp' ID of a pyudev USB device, or None if it has none.
+    """
+    try:
+        vendor = device.attributes.asstring("idVendor")
+        product = device.attributes.asstring("idProduct")
+    except KeyError:
+        return None
+    return f"{vendor}:{product}".lower()
+
+def wait_for_device_udev(device_name, device_id_list):
+    """
+    Block on udev's netlink monitor until a USB device whose ID is in
+    device_id_list is present (already plugged or hot-plugged).
+
+    :param device_name: Descriptive name of the device (string).
+    :param device_id_list: List of IDs (strings) in 'vvvv:pppp' format.
+    """
+    wanted = {device_id.lower() for device_id in device_id_list}
+    context = pyudev.Context()
+    monitor = pyudev.Monitor.from_netlink(context)
+    monitor.filter_by("usb", "usb_device")
+    monitor.start()  # subscribe before scanning, so no plug-in is missed
+
+    for device in context.list_devices(subsystem="usb", DEVTYPE="usb_device"):
+        if usb_device_id(device) in wanted:
+            print(f"[INFO] {device_name} is now detected via USB.")
+            return
+
+    print(f"    [WAITING] {device_name} not detected yet... Waiting for it to be plugged in.")
+    while True:
+        device = monitor.poll(timeout=UDEV_RESCAN_INTERVAL)
+        if device is None:
+            # No event for a while: rescan sysfs in case udevd isn't relaying events
+            found = is_device_plugged(device_id_list)
+        else:
+            found = device.action == "add" and usb_device_id(device) in wanted
+        if found:
+            print(f"[INFO] {device_name} is now detected via USB.")
+            return
+
 def wait_for_device(device_name, device_id_list):
     """
-    Continuously checks for device presence via lsusb every 5 seconds.
-    The script waits until the device is detected, or user presses Ctrl+C.
+    Waits until the device is detected, or user presses Ctrl+C.
+    Uses libusb hotplug callbacks, or udev hotplug events when pyudev is
+    available; otherwise checks for device presence on POLL_SCHEDULE.
     
     :param device_name: Descriptive name of the device (string).
     :param device_id_list: List of IDs (strings) to look for in lsusb.
     """
     print(f"\n[INFO] Please plug in your {device_name} (if not already).")
     print("       The script will detect it automatically.")
+    # Plugged in right now (one sysfs scan): no need to set up any event
+    # source. Checked afresh, since a device seen earlier may be unplugged.
+    if is_device_plugged(device_id_list):
+        print(f"[INFO] {device_name} is now detected via USB.")
+        return
+    if wait_for_device_libusb(device_name, device_id_list):
+        return
+    if pyudev is not None:
+        wait_for_device_udev(device_name, device_id_list)
+        return
+    start = time.monotonic()
+    print(f"    [WAITING] {device_name} not detected yet... Waiting for it to be plugged in.")
+    poll_at = iter(POLL_SCHEDULE)
+    next_poll = 0.0
     while True:
+        next_poll = next(poll_at, next_poll + POLL_INTERVAL)
+        time.sleep(max(0.0, start + next_poll - time.monotonic()))
         if is_device_plugged(device_id_list):
-            print(f"[INFO] {device_name} is now detected via USB.")
             break
-        else:
-            print(f"    [WAITING] {device_name} not detected yet... Retrying in 5s.")
-            time.sleep(5)
+    print(f"[INFO] {device_name} is now detected via USB.")
 
 def setup_udev_rules_and_permissions():
     """
@@ -86,82 +292,140 @@ def setup_udev_rules_and_permissions():
     """
     print("\n[INFO] Setting up udev rules & permissions for RTL-SDR and HackRF.")
 
-    # 1) Create or overwrite RTL-SDR rule if missing
-    if not os.path.isfile(RTLSDR_RULES_PATH):
-        rtl_rule = (
-            'SUBSYSTEM=="usb", ATTR{idVendor}=="0bda", ATTR{idProduct}=="2838", MODE="0666", GROUP="plugdev"\n'
-            'SUBSYSTEM=="usb", ATTR{idVendor}=="0bda", ATTR{idProduct}=="2832", MODE="0666", GROUP="plugdev"\n'
-        )
-        run_command(
-            f'echo "{rtl_rule.strip()}" | sudo tee {RTLSDR_RULES_PATH}',
+    rules_changed = False
+
+    # 1) Create or overwrite RTL-SDR rule if missing or stale
+    if not file_is_current(os.path.join(UDEV_RULES_DIR, "20-rtl-sdr.rules"), RTLSDR_RULES_PATH):
+        if install_root_file(
+            os.path.join(UDEV_RULES_DIR, "20-rtl-sdr.rules"),
+            RTLSDR_RULES_PATH,
             f"Creating udev rules for RTL-SDR at {RTLSDR_RULES_PATH}"
-        )
+        ):
+            rules_changed = True
+        else:
+            print(f"[WARN] RTL-SDR rules were not installed; the device may need sudo to access.")
     else:
-        print(f"[INFO] RTL-SDR rules already exist: {RTLSDR_RULES_PATH}")
+        print(f"[INFO] RTL-SDR rules already up to date: {RTLSDR_RULES_PATH}")
 
-    # 2) Create or overwrite HackRF rule if missing
-    if not os.path.isfile(HACKRF_RULES_PATH):
-        hackrf_rule = 'SUBSYSTEM=="usb", ATTR{idVendor}=="1d50", ATTR{idProduct}=="6089", MODE="0666", GROUP="plugdev"'
-        run_command(
-            f'echo "{hackrf_rule}" | sudo tee {HACKRF_RULES_PATH}',
+    # 2) Create or overwrite HackRF rule if missing or stale
+    if not file_is_current(os.path.join(UDEV_RULES_DIR, "52-hackrf.rules"), HACKRF_RULES_PATH):
+        if install_root_file(
+            os.path.join(UDEV_RULES_DIR, "52-hackrf.rules"),
+            HACKRF_RULES_PATH,
             f"Creating udev rules for HackRF at {HACKRF_RULES_PATH}"
-        )
+        ):
+            rules_changed = True
+        else:
+            print(f"[WARN] HackRF rules were not installed; the device may need sudo to access.")
     else:
-        print(f"[INFO] HackRF rules already exist: {HACKRF_RULES_PATH}")
+        print(f"[INFO] HackRF rules already up to date: {HACKRF_RULES_PATH}")
 
-    # 3) Reload and trigger udev
-    run_command(
-        "sudo udevadm control --reload-rules && sudo udevadm trigger",
-        "Reloading udev rules"
-    )
+    # 3) Reload and trigger udev, once, and only if a rule was written
+    if rules_changed:
+        # Only re-probe our SDRs' USB vendors, not every device on the system
+        # (repeated --attr-match options must all match, so one trigger per
+        # vendor); everything runs under a single sudo
+        udev_steps = [["udevadm", "control", "--reload-rules"]]
+        for vendor_id in sorted({device_id.split(":")[0] for ids in DEVICE_IDS.values() for device_id in ids}):
+            udev_steps.append(["udevadm", "trigger", "--action=add", "--subsystem-match=usb",
+                               f"--attr-match=idVendor={vendor_id}"])
+        run_command(
+            [SUDO, "sh", "-c", " && ".join(shlex.join(step) for step in udev_steps)],
+            "Reloading udev rules and re-triggering events for the SDR USB vendors"
+        )
+    else:
+        print("[INFO] udev rules unchanged; skipping reload.")
 
     # 4) Add user to plugdev group
-    current_user = os.getenv("USER") or "pi"
+    current_user = ACTUAL_USER
     run_command(
-        f"sudo usermod -aG plugdev {current_user}",
+        [SUDO, "usermod", "-aG", "plugdev", current_user],
         f"Adding user '{current_user}' to 'plugdev' group"
     )
 
     print("[INFO] Permissions setup complete. You may need to log out/in or reboot for changes to take effect.\n")
 
+def parse_args():
+    """
+    Parse command-line options.
+    """
+    parser = argparse.ArgumentParser(description="Stage 2: install and test NESDR (RTL-SDR) & HackRF drivers.")
+    parser.add_argument(
+        "--upgrade",
+        action="store_true",
+        help="also run a full 'apt-get upgrade' at the end (stage 1 already upgrades the system)"
+    )
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("\n========== RASPBERRY PI 5 AND COMPONENTS READINESS (STAGE 2) ==========")
     print("This script installs drivers/packages, sets up permissions, and tests NESDR (RTL-SDR) & HackRF devices.\n")
 
-    ########################################################################
-    # 1. Ensure development tools and base dependencies are installed
-    ########################################################################
-    run_command(
-        "sudo apt update -y && sudo apt install -y git build-essential cmake libusb-1.0-0-dev",
-        "Installing development tools (git, build-essential, cmake, libusb)",
-        exit_on_failure=True
-    )
+    # Ask for the sudo password once, up front
+    keep_sudo_alive()
+
+    install_apt_config()
+
+    # Re-runs skip apt entirely for packages that are already installed
+    base_missing = missing_packages(BASE_PACKAGES)
+    hackrf_missing = missing_packages(HACKRF_PACKAGES)
 
     ########################################################################
-    # 2. Install RTL-SDR Tools (for the NESDR)
+    # 1. Refresh package lists (the only apt-get update of this run)
     ########################################################################
-    run_command(
-        "sudo apt install -y rtl-sdr",
-        "Installing RTL-SDR tools",
-        exit_on_failure=True
-    )
+    if base_missing or hackrf_missing or args.upgrade:
+        apt_update_if_stale()
+    else:
+        print("[INFO] All required packages are already installed; skipping apt-get update.")
 
     ########################################################################
-    # 3. Install HackRF Tools
+    # 2. Download every package in the background while udev is set up, so
+    #    the installs below are pure dpkg work with no network stalls.
+    #    No other apt command runs until it is joined, so the locks are
+    #    never contended.
     ########################################################################
-    run_command(
-        "sudo apt install -y hackrf",
-        "Installing HackRF tools",
-        exit_on_failure=True
-    )
+    executor = ThreadPoolExecutor(max_workers=1)
+    download = None
+    if base_missing or hackrf_missing:
+        download = executor.submit(
+            run_command,
+            APT_INSTALL + ["--download-only"] + base_missing + hackrf_missing,
+            "Downloading packages (in background)",
+            capture=True
+        )
 
     ########################################################################
-    # 4. Set up udev rules & permissions
+    # 3. Set up udev rules & permissions
     ########################################################################
     setup_udev_rules_and_permissions()
     print("[INFO] If this is your first time adding these rules, please log out or reboot before testing.")
     print("       However, we will attempt to test immediately. If the tests fail, reboot and try again.\n")
 
+    ########################################################################
+    # 4. Install development tools, base dependencies and RTL-SDR tools
+    #    (for the NESDR) in one apt transaction, then HackRF tools in the
+    #    background while the NESDR is plugged in/tested; nothing before
+    #    step 6 needs them. If the download failed, let apt fetch normally.
+    ########################################################################
+    no_download = ["--no-download"] if download is not None and print_report(download.result()) else []
+    if base_missing:
+        run_command(
+            APT_INSTALL + no_download + base_missing,
+            "Installing development tools (git, build-essential, cmake, libusb) and RTL-SDR tools",
+            exit_on_failure=True
+        )
+    else:
+        print("[INFO] Development tools and RTL-SDR tools are already installed.")
+    hackrf_install = None
+    if hackrf_missing:
+        hackrf_install = executor.submit(
+            run_command,
+            APT_INSTALL + no_download + hackrf_missing,
+            "Installing HackRF tools (in background)",
+            capture=True
+        )
+
     ########################################################################
     # 5. Wait for and test the NESDR (RTL-SDR) device
     ########################################################################
@@ -169,63 +433,83 @@ def main():
 
     # Quick test (rtl_test) to confirm the device is recognized
     run_command(
-        "rtl_test -t",
+        ["rtl_test", "-t"],
         "Verifying that NESDR is detected (rtl_test -t)"
     )
 
-    # Capture a small sample (-n 5e6 = 5 million samples) so it exits on its own
-    run_command(
-        "rtl_sdr -f 109000000 -s 2048000 -g 50 -n 5000000 test_nesdr.bin",
-        "Capturing a finite sample from NESDR (test_nesdr.bin)"
-    )
-
     ########################################################################
-    # 6. Wait for and test the HackRF device
+    # 6. Wait for and test the HackRF device (the NESDR stays plugged in)
     ########################################################################
+    if hackrf_install is not None:
+        # Its output was buffered while the NESDR was tested; show it now
+        print_report(hackrf_install.result(), exit_on_failure=True)
+    executor.shutdown()
     wait_for_device("HackRF", DEVICE_IDS["HackRF"])
 
     # Quick info check
     run_command(
-        "hackrf_info",
+        ["hackrf_info"],
         "Verifying HackRF device (hackrf_info)"
     )
 
-    # Capture a small sample (-n 5e6 = 5 million samples) to exit automatically
-    run_command(
-        "hackrf_transfer -r test_hackrf.bin -f 109000000 -s 20000000 -n 5000000",
-        "Capturing a finite sample from HackRF (test_hackrf.bin)"
-    )
+    ########################################################################
+    # 7. Capture test samples from both devices at the same time; they sit
+    #    on separate USB endpoints, so this takes as long as the slowest.
+    #    Each capture is -n 5e6 = 5 million samples (8-bit I/Q: 2 bytes per
+    #    sample) so it exits on its own.
+    ########################################################################
+    with ThreadPoolExecutor(max_workers=2) as captures:
+        capture_jobs = [
+            captures.submit(
+                capture_to_file,
+                ["rtl_sdr", "-f", "109000000", "-s", "2048000", "-g", "50", "-n", "5000000", "-"],
+                NESDR_CAPTURE_PATH,
+                5000000 * 2,
+                f"Capturing a finite sample from NESDR ({NESDR_CAPTURE_PATH})"
+            ),
+            captures.submit(
+                capture_to_file,
+                ["hackrf_transfer", "-r", "-", "-f", "109000000", "-s", "20000000", "-n", "5000000"],
+                HACKRF_CAPTURE_PATH,
+                5000000 * 2,
+                f"Capturing a finite sample from HackRF ({HACKRF_CAPTURE_PATH})"
+            )
+        ]
+        # result() re-raises anything a capture raised instead of dropping it
+        capture_results = [job.result() for job in capture_jobs]
+    if not all(capture_results):
+        print("[WARN] Not every test capture succeeded; check the errors above and the device connections.")
 
     ########################################################################
-    # 7. Final updates & clean-up
+    # 8. Optional upgrade & autoremove (package lists are fresh from step 1).
+    #    apt already pulled in whatever the packages above depend on.
     ########################################################################
+    if args.upgrade:
+        run_command(APT_GET + ["upgrade", "-y"], "Upgrading the system")
+    # The .deb archive cache is kept so re-runs don't download everything again
     run_command(
-        "sudo apt update -y && sudo apt upgrade -y",
-        "Updating & upgrading the system"
-    )
-    run_command(
-        "sudo apt autoremove -y && sudo apt autoclean -y",
-        "Cleaning up unnecessary packages"
-    )
-    run_command(
-        "sudo apt update -y && sudo apt upgrade -y",
-        "Re-running updates to ensure all repositories are synced"
+        APT_GET + ["autoremove", "--purge", "-y"],
+        "Removing unnecessary packages"
     )
 
     ########################################################################
-    # 8. Reboot recommended
+    # 9. Reboot recommended
     ########################################################################
     print("\n[INFO] Stage 2 complete. A reboot (or log out/in) is recommended so group membership changes take effect.")
     reboot_choice = input("Would you like to reboot now? [y/N]: ").strip().lower()
     if reboot_choice == "y":
-        print("[INFO] Rebooting the system...")
-        run_command("sudo reboot", "Rebooting the Raspberry Pi")
+        print("[INFO] Rebooting the system...", flush=True)
+        # Replace this process with sudo; nothing after this needs to run
+        try:
+            os.execv(SUDO, [SUDO, "reboot"])
+        except OSError as e:
+            print(f"    [ERROR] Rebooting\n      Reason: {e}")
     else:
         print("[INFO] Skipping reboot. You can reboot or log out/in manually later if needed.")
 
     print("\n========== STAGE 2 COMPLETE ==========")
     print("All required drivers, packages, and udev rules for NESDR & HackRF are set up.")
-    print("Test files generated (if no errors): test_nesdr.bin, test_hackrf.bin.")
+    print(f"Test files generated (if no errors): {NESDR_CAPTURE_PATH}, {HACKRF_CAPTURE_PATH}.")
     print("If the device tests failed, please reboot/log out, replug devices, and try again.\n")
 
 if __name__ == "__main__":
@@ -1,67 +1,79 @@
 import subprocess
-import sys
 import os
+import pwd
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-def run_command(command, description=None, exit_on_failure=False, has_retried=False):
-    """
-    Run a shell command and optionally exit if the command fails.
+import command_runner
+
+# Everything this stage installs from apt, resolved in a single transaction:
+# GNU Radio, gr-osmosdr, GQRX, GR-GSM, then Kalibrate-RTL's build dependencies.
+SOFTWARE_PACKAGES = [
+    "gnuradio", "gr-osmosdr", "gqrx-sdr", "gr-gsm",
+    "git", "cmake", "build-essential", "libtool", "autoconf", "automake",
+    "rtl-sdr", "pkg-config", "libfftw3-dev", "librtlsdr-dev",
+]
+
+# Kept out of the install transaction as 'pkg-' (apt-get removes it if
+# present and never pulls it in), so no apt-mark hold is left behind.
+# xtrx-dkms fails to build on the Pi kernel and is only an optional
+# gr-osmosdr backend
+EXCLUDED_PACKAGES = ["xtrx-dkms"]
 
+# udev rule files shipped next to this script
+UDEV_RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "udev")
+
+# The user who invoked the script (through sudo if used), looked up once
+ACTUAL_USER = os.environ.get("SUDO_USER") or pwd.getpwuid(os.getuid()).pw_name
+
+def recover_from_dpkg_error(error_msg):
+    """
     If we see 'dpkg returned an error code (1)', we:
       1) Purge xtrx-dkms
       2) Attempt standard 'fix-broken install' & 'dpkg --configure -a'
-      3) Retry the original command once.
+    so that run_command can retry the original command once.
 
-    :param command: The shell command to run (string).
-    :param description: Text describing the command (string).
-    :param exit_on_failure: If True, exit the script if this command ultimately fails.
-    :param has_retried: Internal flag to prevent infinite recursion. If True, we won't retry again.
+    :param error_msg: Failure reason of the command (string).
+    :return: True if a fix was attempted and the command should be retried.
     """
-    desc = description or command
-    print(f"\n[+] {desc}")
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout = result.stdout.strip()
-        if stdout:
-            print("    Output:")
-            print("    " + "\n    ".join(stdout.splitlines()))
-        print(f"    [SUCCESS] {desc}")
-
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.strip()
-        error_msg = stderr if stderr else str(e)
-        print(f"    [ERROR] {desc}\n      Reason: {error_msg}")
+    if "dpkg returned an error code (1)" not in error_msg.lower():
+        return False
 
-        # If dpkg error code (1) and we haven't retried yet, attempt to fix
-        if "dpkg returned an error code (1)" in error_msg.lower() and not has_retried:
-            print("[WARN] 'dpkg returned an error code (1)'. Attempting to purge xtrx-dkms and fix broken packages.")
+    print("[WARN] 'dpkg returned an error code (1)'. Attempting to purge xtrx-dkms and fix broken packages.")
 
-            # Remove xtrx-dkms forcibly
-            remove_xtrx_dkms()
+    # Remove xtrx-dkms forcibly
+    remove_xtrx_dkms()
 
-            # Attempt standard fix steps
-            attempt_fix_broken_install()
+    # Attempt standard fix steps
+    attempt_fix_broken_install()
+    return True
 
-            # Retry the original command once
-            print(f"[INFO] Retrying command: {desc}")
-            run_command(command, description=desc, exit_on_failure=exit_on_failure, has_retried=True)
-            return
+def run_command(argv, description=None, exit_on_failure=False, cwd=None, input_text=None, capture=False):
+    """
+    Run a command (no shell) with its output streamed, retrying once after a
+    dpkg error (see recover_from_dpkg_error), and optionally exit if it fails.
 
-        if exit_on_failure:
-            sys.exit(1)
+    :param argv: The command to run (list of strings).
+    :param description: Text describing the command (string).
+    :param exit_on_failure: If True, exit the script if this command ultimately fails.
+    :param cwd: Optional directory to run the command in (string).
+    :param input_text: Optional text fed to the command's stdin (string).
+    :param capture: If True, buffer the output instead of streaming it, for
+                    background jobs (see command_runner.run_command).
+    :return: True if the command succeeded, False otherwise; with capture,
+             a (success, report string) tuple.
+    """
+    return command_runner.run_command(
+        argv, description, exit_on_failure, capture=capture, stream=not capture,
+        input_text=input_text, cwd=cwd, recover=recover_from_dpkg_error
+    )
 
 def remove_xtrx_dkms():
     """
     Force-remove xtrx-dkms if it is blocking dpkg from succeeding.
     """
     print("[INFO] Removing xtrx-dkms package via 'apt-get remove --purge -y xtrx-dkms' ...")
-    subprocess.run("sudo apt-get remove --purge -y xtrx-dkms", shell=True, check=False)
+    subprocess.run(command_runner.APT_GET + ["remove", "--purge", "-y", "xtrx-dkms"], check=False)
 
 def attempt_fix_broken_install():
     """
@@ -70,12 +82,12 @@ def attempt_fix_broken_install():
       2) sudo dpkg --configure -a
     """
     fix_cmds = [
-        "sudo apt-get --fix-broken install -y",
-        "sudo dpkg --configure -a"
+        command_runner.APT_GET + ["--fix-broken", "install", "-y"],
+        command_runner.APT_SUDO + ["dpkg", "--configure", "-a"]
     ]
     for cmd in fix_cmds:
-        print(f"[INFO] Running fix command: {cmd}")
-        subprocess.run(cmd, shell=True, check=False, text=True)
+        print(f"[INFO] Running fix command: {' '.join(cmd)}")
+        subprocess.run(cmd, check=False, text=True)
 
 def prompt_desktop_test(app_name, cli_command=None):
     """
@@ -96,138 +108,162 @@ def prompt_confirmation(message):
 
 def get_actual_user():
     """
-    Returns the user that invoked sudo, or $USER if not running under sudo.
-    If everything else fails, defaults to 'pi'.
+    Returns the user that invoked sudo, or the account running the script
+    (from the password database) if not running under sudo.
     """
-    sudo_user = os.getenv("SUDO_USER", "")
-    if sudo_user:
-        return sudo_user.strip()
-    env_user = os.getenv("USER", "pi").strip()
-    return env_user if env_user else "pi"
+    return ACTUAL_USER
 
-def run_command_ignore_code(command, description=None, acceptable_codes=None):
+def run_command_ignore_code(argv, description=None, acceptable_codes=None):
     """
     Run a command and ignore certain non-zero exit codes. 
     If an unlisted non-zero code occurs, raise CalledProcessError as usual.
 
-    :param command: The shell command (string).
+    :param argv: The command (list of strings).
     :param description: Description for logging (string).
     :param acceptable_codes: List of exit codes we can ignore (list of int).
     """
-    desc = description or command
+    desc = description or " ".join(argv)
     print(f"\n[+] {desc} (ignore certain exit codes: {acceptable_codes})")
-    result = subprocess.run(command, shell=True, text=True)
+    result = subprocess.run(argv, text=True)
     if result.returncode != 0 and (acceptable_codes is None or result.returncode not in acceptable_codes):
         print(f"    [ERROR] {desc}\n      Return code: {result.returncode}")
-        raise subprocess.CalledProcessError(result.returncode, command)
+        raise subprocess.CalledProcessError(result.returncode, argv)
     print(f"    [SUCCESS/IGNORED] {desc}")
 
-def main():
+def fetch_kalibrate_rtl(capture=False):
+    """
+    Clone the Kalibrate-RTL sources into ./kalibrate-rtl, or fast-forward an
+    existing clone (re-runs would otherwise fail on 'git clone').
+
+    :param capture: If True, buffer git's output for command_runner.print_report
+                    (when fetching in the background) instead of streaming it.
+    :return: As run_command.
+    """
+    if os.path.isdir("kalibrate-rtl/.git"):
+        return run_command(
+            ["git", "-C", "kalibrate-rtl", "pull", "--ff-only"],
+            "Updating existing Kalibrate-RTL clone",
+            capture=capture
+        )
+    # Only the tip of the default branch is built: no history, no tags
+    return run_command(
+        ["git", "clone", "--depth=1", "--single-branch", "--no-tags",
+         "https://github.com/steve-m/kalibrate-rtl.git"],
+        "Cloning Kalibrate-RTL repository",
+        capture=capture
+    )
+
+def install_packages(packages, description):
+    """
+    Install whichever of the given packages are missing, in one apt
+    transaction (the solver and dpkg triggers run once) that keeps
+    EXCLUDED_PACKAGES out.
+
+    :param packages: Package names (list of strings).
+    :param description: Description shown before installing (string).
+    """
+    # Only hand apt the packages that still need installing
+    missing = command_runner.missing_packages(packages)
+    if not missing:
+        print("[INFO] All required packages are already installed.")
+        return
+    excluded = [pkg + "-" for pkg in EXCLUDED_PACKAGES]
+    run_command(command_runner.APT_INSTALL + missing + excluded, description, exit_on_failure=True)
+
+def main(skip_apt=False):
+    """
+    :param skip_apt: If True, skip every apt step (package lists, installs,
+                     upgrade & autoremove); combined_readiness.py has done them.
+    """
     print("\n========== RASPBERRY PI 5 AND SOFTWARE READINESS (STAGE 2) ==========")
     print("This script installs and tests GNU Radio, GQRX, GR-GSM, Kalibrate-RTL, etc.\n")
 
-    ########################################################################
-    # 1. Install GNU Radio
-    ########################################################################
-    run_command(
-        "sudo apt-get update -y && sudo apt-get install -y gnuradio",
-        "Installing GNU Radio",
-        exit_on_failure=True
-    )
-    prompt_desktop_test("GNU Radio Companion", "gnuradio-companion")
+    # Ask for the sudo password once, up front (desktop tests and the
+    # Kalibrate-RTL build would otherwise outlast sudo's timeout)
+    command_runner.keep_sudo_alive()
 
     ########################################################################
-    # 2. Install gr-osmosdr
+    # 1. Install GNU Radio, gr-osmosdr, gqrx-sdr, GR-GSM & build dependencies
+    #    (one apt transaction: the solver and dpkg triggers run once)
     ########################################################################
-    print("\n[INFO] Installing gr-osmosdr (may show xtrx-dkms errors; usually harmless).")
-    run_command(
-        "sudo apt-get install -y gr-osmosdr",
-        "Installing gr-osmosdr"
-    )
+    if not skip_apt:
+        print("\n[INFO] Installing all packages (xtrx-dkms is left out; gr-osmosdr works without it).")
+    # Kalibrate-RTL is only fetched and built if kal isn't installed yet.
+    # Fetch the sources (step 5) while apt works, if git is already there
+    # (stage 2 components installs it); otherwise after step 1
+    kal_path = shutil.which("kal")
+    executor = ThreadPoolExecutor(max_workers=1)
+    kalibrate_fetch = None
+    if kal_path is None and shutil.which("git"):
+        kalibrate_fetch = executor.submit(fetch_kalibrate_rtl, True)
+
+    if not skip_apt:
+        command_runner.install_apt_config()
+        command_runner.apt_update_if_stale()
+        install_packages(
+            SOFTWARE_PACKAGES,
+            "Installing GNU Radio, gr-osmosdr, gqrx-sdr, GR-GSM and Kalibrate-RTL dependencies"
+        )
 
     ########################################################################
-    # 3. Install gqrx-sdr
+    # 2. Test GNU Radio
     ########################################################################
-    print("\n[INFO] Installing gqrx-sdr (may show xtrx-dkms errors; usually harmless).")
-    run_command(
-        "sudo apt-get install -y gqrx-sdr",
-        "Installing gqrx-sdr"
-    )
-    prompt_desktop_test("GQRX", "gqrx")
+    prompt_desktop_test("GNU Radio Companion", "gnuradio-companion")
 
     ########################################################################
-    # 4. Update & Upgrade, then Cleanup
+    # 3. Test gqrx-sdr
     ########################################################################
-    run_command(
-        "sudo apt-get update -y && sudo apt-get upgrade -y",
-        "Updating & upgrading the system"
-    )
-    run_command(
-        "sudo apt-get autoremove -y && sudo apt-get autoclean -y",
-        "Cleaning up unnecessary packages"
-    )
-    run_command(
-        "sudo apt-get update -y && sudo apt-get upgrade -y",
-        "Re-running updates to ensure repositories are synced"
-    )
+    prompt_desktop_test("GQRX", "gqrx")
 
     ########################################################################
-    # 5. Install GR-GSM
+    # 4. Test GR-GSM
     ########################################################################
-    run_command(
-        "sudo apt-get install -y gr-gsm",
-        "Installing GR-GSM"
-    )
     print("\n[INFO] To test GR-GSM, you'll run `grgsm_livemon -f 950400000` from a desktop terminal.")
     prompt_desktop_test("grgsm_livemon", "grgsm_livemon -f 950400000")
 
     ########################################################################
-    # 6. Install Kalibrate-RTL
+    # 5. Build Kalibrate-RTL (dependencies were installed in step 1)
     ########################################################################
-    print("\n[INFO] Installing dependencies and building Kalibrate-RTL from source.")
+    if kal_path is not None:
+        print(f"\n[INFO] Kalibrate-RTL is already installed ({kal_path}); skipping the build.")
+    else:
+        print("\n[INFO] Building Kalibrate-RTL from source.")
 
-    # Install build dependencies
-    run_command(
-        "sudo apt-get install -y git cmake build-essential libtool autoconf automake rtl-sdr pkg-config libfftw3-dev",
-        "Installing dependencies for Kalibrate-RTL",
-        exit_on_failure=True
-    )
-    run_command(
-        "git clone https://github.com/steve-m/kalibrate-rtl.git",
-        "Cloning Kalibrate-RTL repository"
-    )
-    run_command(
-        "cd kalibrate-rtl",
-        "Entering kalibrate-rtl directory"
-    )
+        if kalibrate_fetch is None:
+            fetch_kalibrate_rtl()
+        else:
+            # The fetch ran alongside the installs and desktop tests; show its output now
+            command_runner.print_report(kalibrate_fetch.result())
 
-    # Install librtlsdr-dev
-    run_command(
-        "sudo apt-get install -y librtlsdr-dev",
-        "Installing librtlsdr-dev"
-    )
+        # Build & install (each step runs inside the clone via cwd=)
+        run_command(
+            ["./bootstrap"],
+            "Running bootstrap in kalibrate-rtl",
+            cwd="kalibrate-rtl"
+        )
+        # One-off build: skip automake's dependency tracking
+        run_command(
+            ["./configure", "--disable-dependency-tracking"],
+            "Configuring kalibrate-rtl",
+            cwd="kalibrate-rtl"
+        )
+        jobs = str(os.cpu_count() or 1)
+        run_command(
+            ["make", "-j", jobs],
+            f"Compiling kalibrate-rtl (make -j{jobs})",
+            cwd="kalibrate-rtl"
+        )
+        run_command(
+            [command_runner.SUDO, "make", "install"],
+            "Installing kalibrate-rtl",
+            cwd="kalibrate-rtl"
+        )
 
-    # Build & install
-    run_command(
-        "cd kalibrate-rtl && ./bootstrap",
-        "Running bootstrap in kalibrate-rtl"
-    )
-    run_command(
-        "cd kalibrate-rtl && ./configure",
-        "Configuring kalibrate-rtl"
-    )
-    run_command(
-        "cd kalibrate-rtl && make",
-        "Compiling kalibrate-rtl"
-    )
-    run_command(
-        "cd kalibrate-rtl && sudo make install",
-        "Installing kalibrate-rtl"
-    )
+    executor.shutdown()
 
     # Some versions of kal fail with -h. We'll allow a 255 exit code.
     run_command_ignore_code(
-        "kal -h",
+        ["kal", "-h"],
         "Testing kalibrate-rtl (kal -h)",
         acceptable_codes=[255]
     )
@@ -235,69 +271,103 @@ def main():
     # Optional quick test
     if prompt_confirmation("Would you like to run kal -s GSM900 now to scan for GSM900 frequencies?"):
         run_command(
-            "kal -s GSM900",
+            ["kal", "-s", "GSM900"],
             "Scanning GSM900 frequencies with kalibrate-rtl"
         )
     else:
         print("[INFO] Skipping kalibrate-rtl test scan.")
 
     ########################################################################
-    # 7. Create new udev rule for HackRF
+    # 6. Create new udev rule for HackRF
     ########################################################################
-    print("\n[INFO] Creating udev rule for HackRF at /etc/udev/rules.d/52-hackrf.rules.")
-    hackrf_rule = 'SUBSYSTEM=="usb", ATTR{idVendor}=="1d50", ATTR{idProduct}=="6089", MODE="0666", GROUP="plugdev"'
-    rule_command = f'echo \'{hackrf_rule}\' | sudo tee /etc/udev/rules.d/52-hackrf.rules'
-    run_command(rule_command, "Creating /etc/udev/rules.d/52-hackrf.rules")
-
-    run_command(
-        "sudo udevadm control --reload-rules && sudo udevadm trigger",
-        "Reloading udev rules"
-    )
+    hackrf_rule = os.path.join(UDEV_RULES_DIR, "52-hackrf.rules")
+
+    # Reload and re-trigger udev only if the rule actually changed
+    if not command_runner.file_is_current(hackrf_rule, "/etc/udev/rules.d/52-hackrf.rules"):
+        print("\n[INFO] Creating udev rule for HackRF at /etc/udev/rules.d/52-hackrf.rules.")
+        if command_runner.install_root_file(
+            hackrf_rule,
+            "/etc/udev/rules.d/52-hackrf.rules",
+            "Creating /etc/udev/rules.d/52-hackrf.rules"
+        ):
+            # Only re-probe HackRF-vendor USB devices, not every device on the
+            # system; reload and trigger run under a single sudo
+            run_command(
+                [command_runner.SUDO, "sh", "-c",
+                 "udevadm control --reload-rules && "
+                 "udevadm trigger --action=add --subsystem-match=usb --attr-match=idVendor=1d50"],
+                "Reloading udev rules and re-triggering events for HackRF"
+            )
+        else:
+            print("[WARN] HackRF udev rule was not installed; skipping the udev reload.")
+    else:
+        print("\n[INFO] HackRF udev rule already up to date: /etc/udev/rules.d/52-hackrf.rules")
 
     ########################################################################
-    # 8. Add user to plugdev group
+    # 7. Add user to plugdev group
     ########################################################################
     actual_user = get_actual_user()
     print(f"\n[INFO] Adding user '{actual_user}' to 'plugdev' group for HackRF USB access.")
     run_command(
-        f"sudo usermod -aG plugdev {actual_user}",
+        [command_runner.SUDO, "usermod", "-aG", "plugdev", actual_user],
         f"Adding '{actual_user}' to plugdev group"
     )
     print("\n[WARNING] Group change usually requires log out/in or reboot. We'll still try a quick test.\n")
 
     ########################################################################
-    # 9. Auto-test hackrf_info if installed
+    # 8. Auto-test hackrf_info if installed
     ########################################################################
     print("[TEST] Attempting 'hackrf_info' as a quick check (non-sudo).")
     # If the user isn't actually in 'plugdev' yet, we might fail. We'll just warn.
-    hackrf_test = subprocess.run("hackrf_info", shell=True)
-    if hackrf_test.returncode != 0:
+    try:
+        hackrf_returncode = subprocess.run(["hackrf_info"]).returncode
+    except FileNotFoundError:
+        hackrf_returncode = 127
+    if hackrf_returncode != 0:
         print("[WARN] 'hackrf_info' returned an error. You may need to log out/in or reboot for group membership to take effect.")
     else:
         print("[INFO] 'hackrf_info' succeeded as non-sudo. Good sign!")
 
     ########################################################################
-    # 10. Optionally run GR-GSM scan with HackRF
+    # 9. Optionally run GR-GSM scan with HackRF
     ########################################################################
     print("\n[INFO] You can run a GSM scan with HackRF using GR-GSM:")
     print("       grgsm_scanner --args=\"hackrf=0\" -b GSM900")
     test_scanner = prompt_confirmation("Would you like to run it now?")
     if test_scanner:
         run_command(
-            "grgsm_scanner --args=\"hackrf=0\" -b GSM900",
+            ["grgsm_scanner", "--args=hackrf=0", "-b", "GSM900"],
             "Scanning GSM900 with HackRF + GR-GSM"
         )
     else:
         print("[INFO] Skipping HackRF + GR-GSM scan test for now.")
 
+    ########################################################################
+    # 10. Upgrade (once, after all installs), then Autoremove
+    ########################################################################
+    if not skip_apt:
+        run_command(
+            command_runner.APT_GET + ["upgrade", "-y"],
+            "Upgrading the system"
+        )
+        # The .deb archive cache is kept so re-runs don't download everything again
+        run_command(
+            command_runner.APT_GET + ["autoremove", "--purge", "-y"],
+            "Removing unnecessary packages"
+        )
+
     ########################################################################
     # 11. Final Steps / Optional Reboot
     ########################################################################
     print("\n[INFO] Stage 2 software installation and tests completed!")
     do_reboot = prompt_confirmation("Would you like to reboot now?")
     if do_reboot:
-        print("[INFO] Rebooting the system...")
-        run_command("sudo reboot", "Rebooting")
+        print("[INFO] Rebooting the system...", flush=True)
+        # Replace this process with sudo; nothing after this needs to run
+        try:
+            os.execv(command_runner.SUDO, [command_runner.SUDO, "reboot"])
+        except OSError as e:
+            print(f"    [ERROR] Rebooting\n      Reason: {e}")
     else:
         print("[INFO] Skipping reboot. You can manually reboot later if needed.\n")
 
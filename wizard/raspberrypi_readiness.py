@@ -1,88 +1,38 @@
-import subprocess
-import sys
-
-def run_command(command, description=None, exit_on_failure=False):
-    """
-    Run a shell command and optionally exit if the command fails.
-    
-    :param command: Command to be executed.
-    :param description: Text to display before running the command (optional).
-    :param exit_on_failure: If True, the script will exit on the command's failure.
-    :return: None
-    """
-    desc = description or command
-    print(f"\n[+] Running: {desc}")
-    try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        # Output for debugging/logging
-        if result.stdout.strip():
-            print("    Output:")
-            print(result.stdout.strip())
-        print(f"[SUCCESS] {desc}")
-    except subprocess.CalledProcessError as e:
-        error_msg = e.stderr.strip() or str(e)
-        print(f"[ERROR] {desc}\n    Reason: {error_msg}")
-        if exit_on_failure:
-            sys.exit(1)
+from command_runner import APT_GET, APT_INSTALL, apt_update_if_stale, install_apt_config, keep_sudo_alive, run_command
 
+# Everything stage 1 installs, resolved in a single apt transaction
+STAGE1_PACKAGES = ["python3", "python3-venv", "python3-pip", "iotop", "logrotate"]
 
 def main():
     print("\n========== RASPBERRYPI 5 READINESS (STAGE 1) ==========\n")
 
-    # Step 1: Update and Upgrade System (critical)
-    run_command(
-        "sudo apt update -y && sudo apt upgrade -y", 
-        "Updating and upgrading the system", 
-        exit_on_failure=True
-    )
-
-    # Step 2: Remove Unnecessary Packages and Clean Up
-    run_command(
-        "sudo apt autoremove -y && sudo apt autoclean -y", 
-        "Removing unnecessary packages and cleaning up"
-    )
-
-    # Step 3: Re-run Updates to Sync Repositories
-    run_command(
-        "sudo apt update -y && sudo apt upgrade -y", 
-        "Re-running updates to sync repositories"
-    )
-
-    # Step 4: Install Python3 and pip
-    run_command(
-        "sudo apt install -y python3 python3-venv python3-pip", 
-        "Installing Python3, venv, and pip"
-    )
+    # Ask for the sudo password once, up front
+    keep_sudo_alive()
 
-    # Step 5: Install iotop for Monitoring
-    run_command(
-        "sudo apt install -y iotop", 
-        "Installing iotop for monitoring"
-    )
+    # Step 1: Install the wizard's apt settings, then refresh package
+    # lists (critical; skipped if fresh)
+    install_apt_config()
+    apt_update_if_stale()
 
-    # Step 6: Install logrotate for Log Management
+    # Step 2: Install Python3 and pip, iotop for monitoring and logrotate
+    # for log management in one transaction
     run_command(
-        "sudo apt install -y logrotate", 
-        "Installing logrotate to manage log files"
+        APT_INSTALL + STAGE1_PACKAGES,
+        "Installing Python3, venv, pip, iotop and logrotate"
     )
 
-    # Step 7: Final Update and Upgrade Cycle
+    # Step 3: Upgrade the System (critical; once, after the installs)
     run_command(
-        "sudo apt update -y && sudo apt upgrade -y", 
-        "Final update and upgrade cycle"
+        APT_GET + ["upgrade", "-y"],
+        "Upgrading the system",
+        exit_on_failure=True
     )
 
-    # Step 8: Final Cleanup
+    # Step 4: Remove Unnecessary Packages (the .deb archive cache is kept
+    # so re-runs don't download everything again)
     run_command(
-        "sudo apt autoremove -y && sudo apt autoclean -y", 
-        "Final cleanup of unnecessary packages"
+        APT_GET + ["autoremove", "-y", "--purge"],
+        "Removing unnecessary packages"
     )
 
     print("\n[INFO] RaspberryPi 5 is now ready and optimized!")
@@ -1,50 +1,154 @@
+import fcntl
+import functools
+import ipaddress
+import os
+import pwd
+import shutil
+import socket
+import struct
 import subprocess
-import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-def run_command(command, description=None, exit_on_failure=False):
+from command_runner import APT_OPTIONS, APT_SUDO, SUDO, apt_update_if_stale, keep_sudo_alive, print_report, run_command
+
+# Optional: psutil reads interface addresses straight from the kernel,
+# without spawning a process.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Kernel routing table (one route per line, hex-encoded, header first)
+PROC_NET_ROUTE = "/proc/net/route"
+
+# Any non-local address works: connecting a UDP socket only picks a route
+OUTBOUND_PROBE_ADDRESS = ("10.255.255.255", 1)
+
+# ioctl request returning an interface's IPv4 address (linux/sockios.h)
+SIOCGIFADDR = 0x8915
+
+# The user who invoked the script (through sudo if used), looked up once
+ACTUAL_USER = os.environ.get("SUDO_USER") or pwd.getpwuid(os.getuid()).pw_name
+
+# SSH is enabled through systemd directly; VNC goes through raspi-config,
+# which knows which server the session needs
+SSH_SERVICE = "ssh"
+
+# Resolved once, like command_runner.SUDO
+SYSTEMCTL = shutil.which("systemctl") or "/bin/systemctl"
+RASPI_CONFIG = shutil.which("raspi-config") or "/usr/bin/raspi-config"
+
+# Upgrade without new recommends (APT_OPTIONS answers conffile prompts)
+APT_UPGRADE_ARGS = ["upgrade", "-y", "--no-install-recommends"]
+
+def default_route_interface():
     """
-    Run a shell command and optionally exit if the command fails.
-    
-    :param command: Command to be executed.
-    :param description: Text to display before running the command (optional).
-    :param exit_on_failure: If True, the script will exit on failure of this command.
-    :return: The command's stdout as a string, or None if an error occurred.
+    Find the interface carrying the default route by reading the kernel
+    routing table, so the reported IP is the one the Pi is reachable on.
+
+    :return: Interface name as a string, or None if there is no default route.
     """
     try:
-        print(f"\n[+] Running: {description or command}")
-        result = subprocess.run(
-            command,
-            shell=True,
-            check=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        # Print command output for visibility
-        if result.stdout.strip():
-            print(f"    Output:\n{result.stdout.strip()}")
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"[!] ERROR: Failed to run: {command}\n    Reason: {e.stderr.strip() or str(e)}")
-        if exit_on_failure:
-            sys.exit(1)  # Stop the script
+        with open(PROC_NET_ROUTE) as f:
+            next(f, None)  # skip header
+            for line in f:
+                fields = line.split()
+                # Destination 00000000 => default route
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+def outbound_ip_address():
+    """
+    Ask the kernel which source address it would use to reach the network,
+    by connecting a UDP socket (no packet is sent, no process is spawned).
+
+    :return: IP address as a string, or None if there is no route.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(OUTBOUND_PROBE_ADDRESS)
+            return sock.getsockname()[0]
+    except OSError:
         return None
 
 
+def interface_address(sock, iface):
+    """
+    Read an interface's IPv4 address with a single SIOCGIFADDR ioctl.
+
+    :param sock: Any AF_INET socket (socket.socket).
+    :param iface: Interface name (string).
+    :return: IP address as a string, or None if the interface has none.
+    """
+    # struct ifreq: 16-byte name, then the sockaddr_in (address at offset 20)
+    ifreq = struct.pack("256s", iface[:15].encode())
+    try:
+        return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+    except OSError:
+        return None
+
+
+def interface_addresses():
+    """
+    Collect the IPv4 addresses of every interface except loopback.
+    Uses psutil when available, then the kernel's outbound route address,
+    and only then asks each interface directly (SIOCGIFADDR).
+
+    :return: List of (interface, address) tuples.
+    """
+    if psutil is not None:
+        return [
+            (iface, addr.address)
+            for iface, addrs in psutil.net_if_addrs().items()
+            if iface != "lo"
+            for addr in addrs
+            if addr.family == socket.AF_INET
+        ]
+
+    address = outbound_ip_address()
+    if address is not None:
+        return [(default_route_interface() or "outbound route", address)]
+
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, iface in socket.if_nameindex():
+            if iface == "lo":
+                continue
+            address = interface_address(sock, iface)
+            if address is not None:
+                addresses.append((iface, address))
+    return addresses
+
+
+@functools.lru_cache(maxsize=1)
 def get_ip_address():
     """
-    Identify the assigned IP address by parsing ifconfig output.
-    
-    :return: IP address as a string, or None if not found.
+    Identify the assigned IP address, preferring the interface that holds
+    the default route over the first address found. Each address is parsed
+    once; loopback and link-local (169.254.x.x, no DHCP lease) ones are skipped.
+    The result is cached for the rest of the run; call
+    get_ip_address.cache_clear() to look it up again.
+
+    :return: IP address as an ipaddress.IPv4Address, or None if not found.
     """
     print("\n[+] Identifying IP address...")
     try:
-        result = subprocess.run("ifconfig", shell=True, text=True, stdout=subprocess.PIPE)
-        match = re.search(r"inet (\d+\.\d+\.\d+\.\d+)", result.stdout)
-        if match:
-            ip_address = match.group(1)
-            print(f"    IP Address found: {ip_address}")
+        addresses = []
+        for iface, addr in interface_addresses():
+            address = ipaddress.IPv4Address(addr)
+            if not (address.is_loopback or address.is_link_local):
+                addresses.append((iface, address))
+        default_iface = default_route_interface()
+        # Stable sort: default-route interface first, others keep their order
+        addresses.sort(key=lambda entry: entry[0] != default_iface)
+        if addresses:
+            iface, ip_address = addresses[0]
+            print(f"    IP Address found: {ip_address} ({iface})")
             return ip_address
         else:
             print("    [!] No IP address found. Ensure the Raspberry Pi is connected to a network.")
@@ -56,72 +160,130 @@ def get_ip_address():
 
 def update_system():
     """
-    Update and upgrade the system.
+    Update (if the package lists are stale) and upgrade the system. All output
+    is buffered, since this runs alongside the SSH/VNC step; print it with
+    print_report once joined.
+
+    :return: (success, report string) tuple, as run_command(capture=True).
     """
-    print("\n[+] Updating and upgrading the system...")
-    # Exit immediately if the update/upgrade fails
-    run_command("sudo apt update -y && sudo apt upgrade -y", 
-                "Updating & Upgrading System", 
-                exit_on_failure=True)
+    report = "\n[+] Updating and upgrading the system...\n"
+    success, update_report = apt_update_if_stale(capture=True)
+    report += update_report
+    if not success:
+        return False, report
+    # eatmydata (if installed) turns dpkg's fsync calls into no-ops, which
+    # dominate unpack time on an SD card
+    eatmydata = ["eatmydata"] if shutil.which("eatmydata") else []
+    success, upgrade_report = run_command(
+        APT_SUDO + eatmydata + ["apt-get"] + APT_OPTIONS + APT_UPGRADE_ARGS,
+        "Upgrading System",
+        capture=True
+    )
+    return success, report + upgrade_report
 
 
-def activate_ssh():
+def systemctl_states(verb, services):
     """
-    Activate and enable SSH service, then verify status.
+    Query the state of several systemd services with a single systemctl call
+    (is-active/is-enabled print one state per unit, in the order given).
+
+    :param verb: 'is-active' or 'is-enabled' (string).
+    :param services: Unit names (list of strings).
+    :return: Dict mapping each unit to its reported state (string).
     """
-    print("\n[+] Activating SSH service...")
-    run_command("sudo systemctl start ssh", "Starting SSH service", exit_on_failure=True)
-    run_command("sudo systemctl enable ssh", "Enabling SSH service", exit_on_failure=True)
+    result = subprocess.run([SYSTEMCTL, verb] + services, text=True, stdout=subprocess.PIPE)
+    return dict(zip(services, result.stdout.split()))
 
-    # Verify that SSH is active
-    status_output = run_command("sudo systemctl is-active ssh", "Verifying SSH service status")
-    if status_output and status_output.strip() == "active":
-        print("    SSH is active and running.")
-    else:
-        print("    [!] SSH is not active. Please investigate.")
+
+def vnc_enabled():
+    """
+    Ask raspi-config whether VNC is already enabled ('get_vnc' prints 0 if
+    so), checking wayvnc or RealVNC to match the session.
+
+    :return: True if VNC is enabled, False otherwise (or if raspi-config is missing).
+    """
+    try:
+        result = subprocess.run(
+            [SUDO, RASPI_CONFIG, "nonint", "get_vnc"],
+            text=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0 and result.stdout.strip() == "0"
 
 
 def activate_vnc():
     """
-    Enable and start the VNC service via raspi-config and systemd, then verify status.
+    Enable VNC via raspi-config, unless it already is. raspi-config picks
+    the server that matches the session: wayvnc under Wayland (the Pi 5's
+    Bookworm default), RealVNC under X11, installing it if needed. Since
+    that can use apt, this must not run while update_system holds the
+    dpkg lock.
     """
     print("\n[+] Activating VNC service...")
+    if vnc_enabled():
+        print("    VNC is already enabled.")
+        return
     # 0 => enable, 1 => disable (for raspi-config nonint do_vnc)
-    run_command("sudo raspi-config nonint do_vnc 0", "Enabling VNC via raspi-config", exit_on_failure=True)
-    run_command("sudo systemctl start vncserver-x11-serviced", "Starting VNC service", exit_on_failure=True)
-    run_command("sudo systemctl enable vncserver-x11-serviced", "Enabling VNC service", exit_on_failure=True)
+    run_command([SUDO, RASPI_CONFIG, "nonint", "do_vnc", "0"], "Enabling VNC via raspi-config", exit_on_failure=True)
+
+
+def activate_ssh():
+    """
+    Enable and start the SSH service with one systemctl call, unless it
+    already is. Doesn't exit on failure, since it runs alongside update_system.
 
-    # Verify that VNC is active
-    status_output = run_command("sudo systemctl is-active vncserver-x11-serviced", "Verifying VNC service status")
-    if status_output and status_output.strip() == "active":
-        print("    VNC is active and running.")
-    else:
-        print("    [!] VNC is not active. Please investigate.")
+    :return: True if SSH is enabled and running, False otherwise.
+    """
+    print("\n[+] Activating SSH service...")
+    enabled = systemctl_states("is-enabled", [SSH_SERVICE])
+    active = systemctl_states("is-active", [SSH_SERVICE])
+    if enabled.get(SSH_SERVICE) == "enabled" and active.get(SSH_SERVICE) == "active":
+        print("    SSH is already enabled and running.")
+        return True
+
+    # 'enable --now' waits for the start job and fails if the service
+    # doesn't come up, so there is no separate is-active check after it
+    if not run_command([SUDO, SYSTEMCTL, "enable", "--now", SSH_SERVICE], "Enabling and starting SSH service"):
+        return False
+    print("    SSH is active and running.")
+    return True
 
 
 def main():
     print("========== Raspberry Pi Automation Script ==========")
 
+    # Ask for the sudo password once, up front
+    keep_sudo_alive()
+
     # Step 1: Identify the IP address
     ip_address = get_ip_address()
     if not ip_address:
         print("[!] Failed to retrieve the IP address. Check your network connection.")
         sys.exit(1)  # Stop execution here if no IP address is found
 
-    # Step 2: Update the system
-    update_system()
-
-    # Step 3: Activate SSH
-    activate_ssh()
-
-    # Step 4: Activate and enable VNC
+    # Step 2: Enable VNC (before apt runs in the background, as raspi-config
+    # may install the VNC server)
     activate_vnc()
 
+    # Step 3: Update the system in the background while SSH is activated;
+    # only apt touches the dpkg lock, so nothing else waits on it
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        update = executor.submit(update_system)
+        ssh_ok = activate_ssh()
+        # Show the upgrade's output before exiting on either failure
+        update_ok = print_report(update.result())
+    if not (ssh_ok and update_ok):
+        sys.exit(1)
+
     # Final Info
     print("\n========== Setup Complete! ==========")
     print("Remote Access Details:")
-    print(f"  SSH:       ssh pi@{ip_address}")
-    print("             (Default credentials: user = pi, password = raspberry)")
+    print(f"  SSH:       ssh {ACTUAL_USER}@{ip_address}")
+    if ACTUAL_USER == "pi":
+        print("             (Default credentials: user = pi, password = raspberry)")
     print(f"  VNC:       Use a VNC viewer to connect to: {ip_address}:1")
 
 